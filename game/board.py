@@ -0,0 +1,245 @@
+# Scoring rules, used by Grid and the simulation so they always agree
+# CP is the chain power, CB is the number of groups popped at once and GB is the size of a group
+# Grid has always counted groups rather than colours for its colour bonus, so two groups of the same colour count as two
+
+def chain_power_lookup(CP):
+    if CP == 1:
+        return 0
+    if CP > 8:
+        return 999
+    return 2**(CP+1)
+
+def colour_bonus_lookup(CB):
+    if CB == 1:
+        return 0
+    return 2**(CB-2)*3
+
+def group_bonus_lookup(GB):
+    if GB < 5:
+        return 0
+    if GB > 10:
+        return 10
+    return GB-3
+
+def placements(columns=6):
+    # Every (column, rotation) a pair of beans can be dropped in, rotation is the same as FallingBean.rotation_state
+    # Rotation 0 is the secondary bean above the primary, 1 is to its right, 2 is below and 3 is to its left
+    return [(c, r) for r in range(4) for c in range(columns) if not (r == 1 and c == columns-1) and not (r == 3 and c == 0)]
+
+def chain_score(chain_power, beans_popped, bonus):
+    # The score for a whole chain, like Grid.update_verify, bonus is the group and colour bonuses added up over the chain
+    return 10*beans_popped*((chain_power_lookup(chain_power)+bonus) or 1) if chain_power else 0
+
+class BitBoard:
+# A grid of beans stored as one integer per colour, where each bit is a cell
+# Bit n is the same cell as Grid.values[n], so the bottom row is bits 0 to columns-1, the row above that is the next columns bits, and so on
+# Python integers can be as big as they need to be, so beans above the top of the grid are fine
+# Finding groups and applying gravity are done with bitwise operations on whole rows and columns at once instead of looking at one bean at a time
+
+    def __init__(self, columns=6, masks=None):
+        self.columns = columns
+        # masks[colour] is the bits of every bean of that colour, colours are 1 to 5 so masks[0] is always 0
+        self.masks = list(masks) if masks else [0]*6
+
+    @classmethod
+    def from_values(cls, values, columns=6):
+        # Makes a board from a Grid's 1D list of beans and Nones
+        board = cls(columns)
+        for n, x in enumerate(values):
+            if x:
+                board.masks[x.colour] |= 1 << n
+        return board
+
+    def copy(self):
+        return BitBoard(self.columns, self.masks)
+
+    def __eq__(self, other):
+        return isinstance(other, BitBoard) and self.columns == other.columns and self.masks == other.masks
+
+    def __hash__(self):
+        return hash((self.columns, *self.masks))
+
+    @property
+    def occupied(self):
+        # Every cell with a bean in it
+        return self.masks[1] | self.masks[2] | self.masks[3] | self.masks[4] | self.masks[5]
+
+    def set(self, position, colour):
+        # Puts a bean of a colour in a cell, or empties it if colour is 0 or None
+        bit = 1 << position
+        for x in range(1, 6):
+            self.masks[x] &= ~bit
+        if colour:
+            self.masks[colour] |= bit
+
+    def colour(self, position):
+        # The colour of the bean in a cell, or 0 if it's empty
+        bit = 1 << position
+        for x in range(1, 6):
+            if self.masks[x] & bit:
+                return x
+        return 0
+
+    # (columns, height): masks of every cell not in the first column and every cell not in the last column, shared by every board
+    edge_masks = {}
+
+    def edges(self, height):
+        # Returns (height, every cell not in the first column, every cell not in the last column) for a board of at least that height
+        # Shifting a mask left by one moves every bit one column right, but bits in the last column would wrap round to the first column of the row above, so they're masked off first, and the same going left
+        # These are made once for each height and shared, as boards are copied a lot
+        key = (self.columns, height)
+        if key not in self.edge_masks:
+            row = (1 << self.columns)-1
+            rows = sum(row << (n*self.columns) for n in range(height))
+            self.edge_masks[key] = (height, rows & ~sum(1 << (n*self.columns) for n in range(height)), rows & ~sum(1 << (n*self.columns+self.columns-1) for n in range(height)))
+        return self.edge_masks[key]
+
+    def neighbours(self, mask):
+        # Every cell next to a cell in mask, up, down, left or right
+        c = self.columns
+        height, not_first, not_last = self.edges(mask.bit_length()//c+2)
+        return (mask << c) | (mask >> c) | ((mask & not_last) << 1) | ((mask & not_first) >> 1)
+
+    def group(self, position):
+        # The bits of every bean connected to the bean at position that's the same colour, including itself
+        # Flood fills by growing the group into its same coloured neighbours until it stops growing
+        colour = self.colour(position)
+        if not colour:
+            return 0
+        return self.fill(1 << position, self.masks[colour])
+
+    def fill(self, group, mask):
+        while True:
+            grown = group | (self.neighbours(group) & mask)
+            if grown == group:
+                return group
+            group = grown
+
+    def groups(self, size=4, seeds=None):
+        # Every group with at least size beans in it, as a list of (colour, bits)
+        # If seeds is given, only groups with a bean in seeds are looked for
+        out = []
+        for colour in range(1, 6):
+            left = self.masks[colour] if seeds is None else self.masks[colour] & seeds
+            while left:
+                group = self.fill(left & -left, self.masks[colour]) # Start from the lowest bean that isn't in a group yet
+                left &= ~group
+                if group.bit_count() >= size:
+                    out.append((colour, group))
+        return out
+
+    def remove(self, mask):
+        # Empties every cell in mask
+        for x in range(1, 6):
+            self.masks[x] &= ~mask
+
+    def gravity(self):
+        # Makes every bean fall down its column until it lands on another bean or the bottom of the grid
+        # A bean is supported if it's on the bottom row or on top of a supported bean, every bean that isn't falls one row, and this repeats until they all are
+        # Returns True if anything fell
+        c = self.columns
+        fell = False
+        while True:
+            occupied = self.occupied
+            supported = occupied & ((1 << c)-1)
+            while True:
+                x = supported | (occupied & (supported << c))
+                if x == supported:
+                    break
+                supported = x
+            falling = occupied & ~supported
+            if not falling:
+                return fell
+            fell = True
+            for x in range(1, 6):
+                if self.masks[x] & falling:
+                    self.masks[x] = (self.masks[x] & ~falling) | ((self.masks[x] & falling) >> c)
+
+    def resolve(self, changed=None):
+        # Pops groups and applies gravity until nothing else pops, the same as Grid but all at once, and returns the score for the chain
+        # changed is the bits of beans that were just placed, as only groups with a bean that's moved in them can be new
+        chain_power, beans_popped, bonus = 0, 0, 0
+        while True:
+            groups = self.groups(seeds=changed)
+            if not groups:
+                return chain_score(chain_power, beans_popped, bonus)
+            chain_power += 1
+            beans_popped = max(beans_popped, sum(group.bit_count() for colour, group in groups))
+            bonus += sum(group_bonus_lookup(group.bit_count()) for colour, group in groups)+colour_bonus_lookup(len(groups))
+            for colour, group in groups:
+                self.remove(group)
+            before = list(self.masks)
+            self.gravity()
+            # Only the beans that fell can be in a new group
+            changed = 0
+            for x in range(1, 6):
+                changed |= (before[x] ^ self.masks[x]) & self.masks[x]
+
+    @staticmethod
+    def positions(mask):
+        # The cell numbers of every bit in a mask, lowest first
+        out = []
+        while mask:
+            bit = mask & -mask
+            out.append(bit.bit_length()-1)
+            mask ^= bit
+        return out
+
+class DisjointSet:
+# Keeps track of which beans are connected to which, so the size of a bean's group can be looked up without flood filling
+# Each group has a root position, parent points every position towards its root, and members has the positions in each root's group
+# Joining two groups moves the smaller group's members into the bigger one, so placing beans one at a time takes about as long as the number of beans
+# Beans can't be taken out of a group, so after beans are popped or start falling it has to be made again with from_board
+
+    def __init__(self):
+        self.parent = {} # position: position closer to the root
+        self.members = {} # root: list of positions in the group
+
+    @classmethod
+    def from_board(cls, board):
+        # Places every bean on a BitBoard, lowest first
+        out = cls()
+        for colour in range(1, 6):
+            for position in board.positions(board.masks[colour]):
+                out.place(board, position)
+        return out
+
+    def __contains__(self, position):
+        return position in self.parent
+
+    def find(self, position):
+        # The root of a position's group
+        # Every position looked at on the way is pointed at the one two steps above it, so the path is shorter next time
+        parent = self.parent
+        while parent[position] != position:
+            parent[position] = parent[parent[position]]
+            position = parent[position]
+        return position
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if len(self.members[a]) < len(self.members[b]):
+            a, b = b, a
+        self.parent[b] = a
+        self.members[a] += self.members.pop(b)
+
+    def place(self, board, position):
+        # Adds the bean at position on the board and joins it to the groups of any beans next to it of the same colour
+        self.parent[position] = position
+        self.members[position] = [position]
+        colour, c = board.colour(position), board.columns
+        for x in (position+c, position-c, position-1 if position % c else -1, position+1 if (position+1) % c else -1):
+            if x in self.parent and board.colour(x) == colour:
+                self.union(position, x)
+
+    def group(self, position):
+        # Every position in the same group as position
+        return self.members[self.find(position)]
+
+    def size(self, position):
+        return len(self.group(position))
+
+    def groups(self):
+        return list(self.members.values())
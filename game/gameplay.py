@@ -1,5 +1,8 @@
 from kris_engine import Entity
-from random import randint
+from kris_engine.atlas import Atlas
+from replay import Replay
+from board import BitBoard, DisjointSet, chain_power_lookup, colour_bonus_lookup, group_bonus_lookup
+from random import Random, randrange
 from copy import copy
 import pygame
 # Pygame used for key library and some constants
@@ -39,6 +42,11 @@ ACTION_IDS = {
     "DOWN": 6,
 }
 
+# Every bean texture, {colour}_{texture}.png, these are packed into one atlas for drawing
+BEAN_TEXTURES = tuple(f"{colour}_{texture}.png" for colour in COLOUR_IDS.values() for texture in range(1, 28))
+# The same names looked up by BEAN_TEXTURE_TABLE[colour][texture], so drawing a bean doesn't have to format a string
+BEAN_TEXTURE_TABLE = tuple(tuple(f"{colour}_{texture}.png" for texture in range(28)) for colour in range(6))
+
 HANDLING_SETTINGS = {
     "DAS": 45,
     "ARR": 15
@@ -48,13 +56,22 @@ HANDLING_SETTINGS = {
 class Grid(Entity):
     # columns is more important as rows is not restricting, the grid can contain more than that many rows of beans but it defines the death point for the grid
     # values allows a non-empty grid to be loaded
-    def __init__(self, engine, scene, id, input_handler, rows=12, columns=6, values=[], position=(16/320, 16/224), bean_queue_position=(0.4, 40/224)):
+    # seed decides every pair of beans the grid gets, so the same seed and inputs always play the same game, a random one is picked if it isn't given
+    # save_replay is a file path to save the game to when it ends so it can be played back, see replay.py, nothing is saved if it isn't given
+    def __init__(self, engine, scene, id, input_handler, rows=12, columns=6, values=[], position=(16/320, 16/224), bean_queue_position=(0.4, 40/224), seed=None, save_replay=None):
         super().__init__(engine, scene, id)
         self.input_handler = input_handler
+        self.seed = randrange(2**32) if seed is None else seed
+        self.save_replay = save_replay
         # score entity aggregated by grid entity
         self.score = self.engine.load_entity(Score, scene)
         # 1D list filled with Bean objects or None representing an empty cell
-        self.values = values
+        # Copied, as the grid changes it in place and the default list would otherwise be shared by every grid
+        self.values = list(values)
+        # The same grid as a BitBoard, used to find colour groups, kept in sync with values by set_value
+        self.board = BitBoard.from_values(self.values, columns)
+        # Which beans are connected to which, see the connected property
+        self.__connected = None
         # used to store GravityBeans
         self.gravity = []
         self.state = "GRAVITY"
@@ -72,6 +89,11 @@ class Grid(Entity):
         # Commonly used in drawing calculations, so precalculated to prevent unnecessary repeated division
         self.cache = (16/320, 16/224)
         self.position = position
+        # All the bean textures at the size they're drawn at, shared with the BeanQueue
+        self.atlas = Atlas(self.engine, BEAN_TEXTURES, self.cache[1])
+        # Every (texture, x, y) drawn last frame, and the sprites being drawn this frame, for dirty rects
+        self.drawn = set()
+        self.frame = None
         # Correct textures if a non-empty grid has been loaded
         self.eval_all_textures()
         # List representing groups that are being popped during a chain reaction
@@ -80,7 +102,7 @@ class Grid(Entity):
         self.verify = self.count_all()
 
         # BeanQueue entity aggregated by Grid object
-        self.queue = self.engine.load_entity(BeanQueue, self.scene, bean_queue_position)
+        self.queue = self.engine.load_entity(BeanQueue, self.scene, bean_queue_position, self.atlas, self.seed)
         # method of BeanQueue used to get the next falling bean
         self.falling = FallingBean(*self.queue.get_next(), self)
 
@@ -136,16 +158,20 @@ class Grid(Entity):
                 self.values[x].row = x // self.columns
                 self.values[x].column = x % self.columns
                 self.verify.add(self.values[x])
-                self.values[x] = None
+                self.set_value(x, None)
         else: # The chain has ended
             try:
                 # Check for death
                 if self.values[(self.rows-1)*self.columns + 2]:
                     self.state = "DIE"
-                    self.score.dump_score()
-                    self.score.output_top_scores()
             except: pass # If the function errored then the grid isn't big enough to contain the death cell
             # In which case it definitely doesn't have anything in it
+            if self.state == "DIE" and self.input_handler.replay is None:
+                # Save the score, and the game so it can be played back if asked to, unless this is a replay
+                self.score.dump_score()
+                self.score.output_top_scores()
+                if self.save_replay:
+                    Replay.record(self).save(self.save_replay)
             if self.state != "DIE":
                 # Get our next falling bean
                 self.falling = FallingBean(*self.queue.get_next(), self)
@@ -159,27 +185,10 @@ class Grid(Entity):
                 self.group_bonus = 0
                 self.beans_popped = 0
 
-    @staticmethod
-    def chain_power_lookup(CP):
-        if CP == 1:
-            return 0
-        if CP > 8:
-            return 999
-        return 2**(CP+1)
-    
-    @staticmethod
-    def colour_bonus_lookup(CB):
-        if CB == 1:
-            return 0
-        return 2**(CB-2)*3
-    
-    @staticmethod
-    def group_bonus_lookup(GB):
-        if GB < 5:
-            return 0
-        if GB > 10:
-            return 10
-        return GB-3
+    # The scoring rules are in board.py so the simulation can use them too
+    chain_power_lookup = staticmethod(chain_power_lookup)
+    colour_bonus_lookup = staticmethod(colour_bonus_lookup)
+    group_bonus_lookup = staticmethod(group_bonus_lookup)
 
     def animate_verify(self): # Simple animation implementation
         self.counter += 1
@@ -193,18 +202,17 @@ class Grid(Entity):
             self.engine.get_asset(f"pop{self.chain_power if self.chain_power < 7 else 6}.ogg", audio=True).play()
 
     def animate_gravity(self):
+        # Every gravity bean is moved on one step of its animation at once, and the ones that have finished are taken out afterwards
+        # A new list is made rather than removing from the one being looped over, which would skip the bean after each one removed
+        falling, landed = [], []
         for x in self.gravity:
-            try:
-                # Gravity beans are animated using generator objects that can cleanly set things like their current position and texture
-                next(x.position)
-            except StopIteration:
-                # When the animation finishes we make a new bean in it's place, update it's texture and see if it fell to make a group
-                self.gravity.remove(x)
-                col = x.colour
-                bean = Bean(col)
-                self.values[x.destination] = bean
-                self.eval_surrounding(x.destination)
-                self.count(x.destination)
+            (falling if x.advance() else landed).append(x)
+        self.gravity = falling
+        for x in landed:
+            # When the animation finishes we make a new bean in it's place, update it's texture and see if it fell to make a group
+            self.set_value(x.destination, Bean(x.colour))
+            self.eval_surrounding(x.destination)
+            self.count(x.destination)
         if not self.gravity: # Once all gravity beans have finished their animations
             self.counter += 1 # A short pause before the next verification
             if self.counter == self.counter_goal:
@@ -220,6 +228,8 @@ class Grid(Entity):
                     column.pop(0)
                 else:
                     self.values[x] = None
+        self.board = BitBoard.from_values(self.values, self.columns)
+        self.__connected = None
 
     def update_gravity(self):
         # For every column
@@ -242,7 +252,7 @@ class Grid(Entity):
                 # For all the beans in the column above the ones that didn't fall at all
                 for x in range(n + len(split_column[0])*self.columns, len(self.values), self.columns):
                     # Remove them from the grid (they'll be replaced when the gravity beans are done falling)
-                    self.values[x] = None
+                    self.set_value(x, None)
         # This represents the small wait after all the beans are finished falling
         self.counter = 0
         self.counter_goal = 50
@@ -263,76 +273,101 @@ class Grid(Entity):
     def place_bean(self, bean, position):
         # Pads the list with empty cells if it's not long enough already
         self.values += [None]*(position-len(self.values))
-        self.values[position] = bean
+        self.set_value(position, bean)
         # Checks for new colour groups and updates the bean's texture
         self.count(position)
         self.eval_surrounding(position)
 
+    def set_value(self, position, bean):
+        # Puts a bean (or None) in a cell of both values and the board
+        replaced = self.values[position]
+        self.values[position] = bean
+        self.board.set(position, bean.colour if bean else 0)
+        if not bean or replaced: # Taking a bean out, or putting one over it, can split its group, so the groups are worked out again the next time they're needed
+            self.__connected = None
+        elif self.__connected is not None: # Putting a bean in only ever joins groups together
+            self.__connected.place(self.board, position)
+
+    @property
+    def connected(self):
+        # A DisjointSet of the beans in the grid, made again from the board if beans have been taken out since it was last used
+        # Beans are popped and lifted up to fall all at once, so this is only remade once per pop or gravity, and the beans landing after are added one at a time
+        if self.__connected is None:
+            self.__connected = DisjointSet.from_board(self.board)
+        return self.__connected
+
     def render(self):
-        # Draw the grid with all the beans in it
-        self.render_grid()
-        # Do any special drawing a state may require
+        # Draw the grid with all the beans in it, and do any special drawing a state may require, all from the atlas in a single blits call
+        # In dirty rect mode the beans from dirty are drawn instead, as the update thread may have changed things since
+        self.atlas.blits(self.frame if self.frame is not None else self.sprites())
+        # backdrop3.png is drawn over the beans by the scene, see overlays in exercise.py
+
+    def sprites(self):
+        # Returns a list of (texture, position) for every bean being drawn this frame
+        out = self.grid_sprites()
         match self.state:
             case "GRAVITY_ANIMATION":
-                self.render_gravity()
+                out += self.gravity_sprites()
             case "VERIFY_ANIMATION":
-                self.render_verify()
+                out += self.verify_sprites()
             case "FALL":
-                self.render_falling()
+                out += self.falling_sprites()
             case _:
                 pass
-        # Then draw backdrop3.png last
-        # This means that beans that are outside of the grid, such as falling beans that just spawned in, appear behind the background
-        # Not seeing this represents death, since the bottom of the grid has opened up 
-        self.engine.screen.blit(self.engine.get_asset("backdrop3.png", scale=(self.engine.width, self.engine.height)), (0, 0))
+        return out
+
+    def dirty(self):
+        # Compares what's being drawn this frame against last frame, anything that was added or removed needs redrawing
+        # Positions are rounded down the same way blit does, so beans that haven't visibly moved aren't redrawn
+        self.frame = self.sprites()
+        drawn = {(texture, int(x), int(y)) for texture, (x, y) in self.frame}
+        last, self.drawn = self.drawn, drawn
+        return [pygame.Rect((x, y), self.atlas.rect(texture).size) for texture, x, y in drawn ^ last]
 
-    def render_grid(self):
+    def grid_sprites(self):
         # Draws our 1D array in a 2D grid on screen by moving to the next row each time we hit the number of columns
         column = 0
         row = 0
+        beans = []
         for x in self.values:
             if type(x) == Bean:
-                self.render_bean(x, row, column)
+                beans.append((x.texture, self.bean_position(row, column)))
             column += 1
             if column == self.columns:
                 column = 0
                 row += 1
+        return beans
 
-    def render_bean(self, x, row, column):
-        # Used all over the code to draw a bean on screen
-        self.engine.screen.blit(
-            self.engine.get_asset(x.texture, scale=self.cache[1]),
-            ((self.cache[0]*column+self.position[0])*self.engine.width,
+    def bean_position(self, row, column):
+        # Where on screen a bean in a given grid cell is drawn
+        return ((self.cache[0]*column+self.position[0])*self.engine.width,
             (1-(self.cache[1]*row+self.position[1]*2))*self.engine.height)
-        )
 
-    def render_gravity(self):
+    def gravity_sprites(self):
         # Gravity beans are already being animated by the update thread so we just need to draw them in their current state
-        for x in self.gravity:
-            self.render_bean(x, x.row, x.column)
+        return [(x.texture, self.bean_position(x.row, x.column)) for x in self.gravity]
 
-    def render_verify(self):
+    def verify_sprites(self):
         # Beans that are being popped flash on and off the screen every other frame, which instead of having an empty texture is done by just not drawing it
-        if self.counter > 230:
-            pass
         if 25 < self.counter < 180 and self.counter%10 < 5:
-            for x in self.verify:
-                self.render_bean(x, x.row, x.column)
+            return [(x.texture, self.bean_position(x.row, x.column)) for x in self.verify]
+        return []
 
-    def render_falling(self):
+    def falling_sprites(self):
         # Draws the primary falling bean, renders the position of the secondary bean, which is relative to the primary bean and dependant on rotation state
-        self.render_bean(self.falling.primary, self.falling.row, self.falling.column)
-        match self.falling.rotation_state:
+        falling = self.falling
+        match falling.rotation_state:
             case 0:
-                self.render_bean(self.falling.secondary, self.falling.row+1, self.falling.column)
+                secondary = self.bean_position(falling.row+1, falling.column)
             case 1:
-                self.render_bean(self.falling.secondary, self.falling.row, self.falling.column+1)
+                secondary = self.bean_position(falling.row, falling.column+1)
             case 2:
-                self.render_bean(self.falling.secondary, self.falling.row-1, self.falling.column)
+                secondary = self.bean_position(falling.row-1, falling.column)
             case 3:
-                self.render_bean(self.falling.secondary, self.falling.row, self.falling.column-1)
+                secondary = self.bean_position(falling.row, falling.column-1)
             case _:
                 raise ValueError("Invalid rotation state")
+        return [(falling.primary.texture, self.bean_position(falling.row, falling.column)), (falling.secondary.texture, secondary)]
 
     def eval_all_textures(self):
         # Used for getting the right texture for every bean when loading in a grid instead of updating in real time
@@ -412,74 +447,53 @@ class Grid(Entity):
             self.eval_texture(x)
 
     def count_all(self): # A function to scan the entire grid for colour groups. Similar to count, see explanation there
-        to_be_counted = [x for x in range(len(self.values)) if type(self.values[x]) == Bean]
         to_be_destroyed = set()
-        while to_be_counted:
-            group = {to_be_counted[0]}
-            surroundings = self.get_surroundings(to_be_counted[0], group)
-            for x in surroundings:
-                group.add(x)
-                surroundings += self.get_surroundings(x, group)
-            for x in group:
-                to_be_counted.remove(x)
+        for group in self.connected.groups():
             if len(group) >= 4:
-                to_be_destroyed = to_be_destroyed.union(group)
+                group = set(group)
+                to_be_destroyed |= group
                 self.groups.append(group)
         return to_be_destroyed
-    
+
     def count(self, bean): # Checks if a bean is in a colour group
         # First, we check if the bean has already been detected as being in a colour group. If it hasn't, 
         if bean not in self.verify:
-            # Create a set containing the bean
-            group = {bean}
-            # Use get surroundings to get all the adjacent beans of the same colour
-            surroundings = self.get_surroundings(bean, group)
-            # We iterate through the list
-            for x in surroundings:
-                # And add all of these adjacent same colour beans to our set
-                # We will get duplicates but those will be removed by the set
-                group.add(x)
-                # And then we find the same colour beans that are adjacent to those beans
-                surroundings += self.get_surroundings(x, group)
-            # Iteration will continue until the end of the list is reached, which signifies that every bean in the set doesn't have an adjacent bean that isn't already in the set
-            # So if the group is bigger than 4, then set it to be popped
+            # Get every bean connected to it of the same colour, which is already known without searching the grid
+            group = self.connected.group(bean)
+            # So if the group is 4 or bigger, then set it to be popped
             if len(group) >= 4:
+                group = set(group)
                 self.verify = self.verify.union(group)
                 self.groups.append(group)
 
-    def get_surroundings(self, x, group):
-        tests = []
-        if x+self.columns < len(self.values): # If the row above the bean is contained within the grid
-            tests.append(x+self.columns) # Check the bean above
-        if x-self.columns >= 0: # If the bean isn't on the bottom row
-            tests.append(x-self.columns) # Check the bean below
-        if x % self.columns: # If the bean isn't on the left edge
-            tests.append(x-1) # Check the bean on the left
-        if (x + 1) % self.columns: # If the bean isn't on the right edge
-            tests.append(x+1) # Check the bean on the right
-        # Return a list of beans that share the same colour
-        return [y for y in tests if y >= 0 and y < len(self.values) and self.values[y] and self.values[y].colour == self.values[x].colour and y not in group]
-
 # BeanQueue is an Entity
 class BeanQueue(Entity):
-    def __init__(self, engine, scene, id, position):
+    # atlas is the Grid's bean atlas, if one isn't given then the queue makes its own
+    def __init__(self, engine, scene, id, position, atlas=None, seed=None):
         super().__init__(engine, scene, id)
-        # Beans are randomly generated using randint
-        self.next = (Bean(randint(1,5)), Bean(randint(1, 5)))
+        # Beans are randomly generated by the queue's own random number generator, so the order only depends on the seed and not on anything else using random
+        self.random = Random(seed)
+        self.next = self.pair()
         self.cache = 16/224
         self.position = position
+        self.atlas = atlas or Atlas(self.engine, BEAN_TEXTURES, self.cache)
+        self.drawn = None # The textures on screen last frame, for dirty rects
 
     def render(self): # An exact copy of the render_bean function, but must be duplicated because passing in the grid overcomplicates things
-        self.engine.screen.blit(
-            self.engine.get_asset(self.next[0].texture, scale=self.cache),
-            (self.position[0]*self.engine.width,
-            self.position[1]*self.engine.height)
-        )
-        self.engine.screen.blit(
-            self.engine.get_asset(self.next[1].texture, scale=self.cache),
-            (self.position[0]*self.engine.width,
-            (self.cache+self.position[1])*self.engine.height)
-        )
+        textures = self.drawn or (self.next[0].texture, self.next[1].texture)
+        self.atlas.blits((
+            (textures[0], (self.position[0]*self.engine.width, self.position[1]*self.engine.height)),
+            (textures[1], (self.position[0]*self.engine.width, (self.cache+self.position[1])*self.engine.height))
+        ))
+
+    def dirty(self):
+        # The queue only changes when the next pair does, and both beans are always in the same place
+        textures = (self.next[0].texture, self.next[1].texture)
+        if textures == self.drawn:
+            return []
+        self.drawn = textures
+        w, h = self.atlas.rect(textures[0]).size
+        return [pygame.Rect(self.position[0]*self.engine.width, self.position[1]*self.engine.height, w, 2*h+1)]
     
     def update(self):
         # Was planned to be animated but dropped due to time constraints, the potential is still there
@@ -487,150 +501,122 @@ class BeanQueue(Entity):
 
     def get_next(self): # Returns a tuple of two beans and queues the next pair
         x = self.next
-        self.next = (Bean(randint(1,5)), Bean(randint(1, 5)))
+        self.next = self.pair()
         return x
 
+    def pair(self):
+        return (Bean(self.random.randint(1, 5)), Bean(self.random.randint(1, 5)))
+
 # Bean is NOT an Entity, it is just aggregated by Grid
 class Bean:
-    # The values of up, down, left and right may be slightly confusing
-    # But they are restricted to 0, False and True for performance
-    # 0 means there is no bean there
-    # False means there is a bean there, but it's not the same colour
-    # True means there is a bean there, and it's the same colour
+    # A bean is only a colour, which of its neighbours it's connected to and a state, so it uses __slots__ to keep it small as there are a lot of them
+    # connections is a 4-bit integer, up is 8, down is 4, left is 2 and right is 1, and it's the number of the texture for that combination
+    # state is used to assign other textures that don't apply to this, and it takes priority over connections, 0 means no state
+    # row and column are only set when the bean is being drawn outside of the grid, like when it's being popped
+    __slots__ = ("colour", "connections", "state", "row", "column")
+
     def __init__(self, colour, up=0, down=0, left=0, right=0, state=0):
         self.colour = colour if type(colour) == int else COLOUR_IDS[colour]
-        self.__up = up
-        self.__down = down
-        self.__left = left
-        self.__right = right
-        self.__state = state
-        self.get_texture()
+        # up, down, left and right are True if there's a bean of the same colour there
+        self.connections = bool(up) << 3 | bool(down) << 2 | bool(left) << 1 | bool(right)
+        self.state = state
 
     def __str__(self): # For debugging
         return f"Bean({self.colour})"
     __repr__ = __str__
 
-    def get_texture(self):
-        # The combination of up, down, left and right bits can be used to generate a unique 4-bit integer representing the correct texture
-        # self.state is used to assign other textures that don't apply to this, and it takes priority over this texture
-        if self.state:
-            texture = self.state
-        else:
-            texture = (self.up << 3) + (self.down << 2) + (self.left << 1) + self.right
-        if texture == 0:
-            texture = TEXTURE_STATE_IDS["NORMAL"]
-        self.texture = f"{self.colour}_{texture}.png"
-        return self.texture
+    @property
+    def texture(self):
+        # Only looked up when the bean is drawn, rather than every time a neighbour changes
+        # A bean with no state and no connections uses the normal texture
+        return BEAN_TEXTURE_TABLE[self.colour][self.state or self.connections or TEXTURE_STATE_IDS["NORMAL"]]
 
-    # The below setters are used to automatically update the texture of a bean when one of the parameters affecting it's texture changes
+    # The values of up, down, left and right are set by Grid.eval_texture to 0 (no bean there), False (a bean of a different colour) or True (a bean of the same colour)
+    # Only True connects, so they're stored as one bit each in connections
 
-    @property
-    def state(self):
-        if not self.__state and not (self.up or self.down or self.left or self.right):
-            return TEXTURE_STATE_IDS["NORMAL"]
-        return self.__state
+    def connect(self, bit, a):
+        self.connections = self.connections | bit if a else self.connections & ~bit
 
     @property
     def up(self):
-        return self.__up
+        return bool(self.connections & 8)
 
     @up.setter
     def up(self, a):
-        self.__up = a
-        self.get_texture()
-    
+        self.connect(8, a)
+
     @property
     def down(self):
-        return self.__down
+        return bool(self.connections & 4)
 
     @down.setter
     def down(self, a):
-        self.__down = a
-        self.get_texture()
+        self.connect(4, a)
 
     @property
     def left(self):
-        return self.__left
+        return bool(self.connections & 2)
 
     @left.setter
     def left(self, a):
-        self.__left = a
-        self.get_texture()
+        self.connect(2, a)
 
     @property
     def right(self):
-        return self.__right
+        return bool(self.connections & 1)
 
     @right.setter
     def right(self, a):
-        self.__right = a
-        self.get_texture()
-
-    @property
-    def state(self):
-        return self.__state
-
-    @state.setter
-    def state(self, a):
-        self.__state = a
-        self.get_texture()
+        self.connect(1, a)
+
+# The squish animation a bean plays after it lands, as (state, number of updates) pairs
+GRAVITY_SQUISH = (
+    ("NORMAL", 5), ("SQUISH2", 15), ("NORMAL", 5), ("SQUISH1", 10),
+    ("NORMAL", 5), ("SQUISH2", 15), ("NORMAL", 5), ("SQUISH1", 10),
+    ("NORMAL", 5), ("SQUISH2", 10), ("NORMAL", 5), ("SQUISH1", 5),
+    ("NORMAL", 5), ("SQUISH2", 30)
+)
 
 # GravityBean inherits from Bean, but it is not an Entity
 class GravityBean(Bean):
+    # Every bean that falls the same distance plays the same animation, so instead of each bean running its own code the animation is worked out once
+    # keyframes(row_distance) is a tuple with a (rows fallen, state) pair for each update, and a bean only has to remember how many updates it's done
+    __slots__ = ("destination", "row_distance", "start", "tick", "frames")
+    tables = {} # row_distance: keyframes, shared by every GravityBean
+
     def __init__(self, bean, destination, row_distance, row, column):
         super().__init__(bean.colour)
 
         self.row = row
+        self.start = row
         self.column = column
         self.destination = destination
         # Row distance is the number of rows that the bean will fall
         self.row_distance = row_distance
-
-
-        # As shown above generators are really helpful for animations
-        # They allow me to use for loops where each iteration of the for loop represents an update
-        # It allows for this really clean animation code that allows me to run any code I want, in this case changing positions and textures
-        def position():
-            #for n in range(40):
-            #    yield
-            self.state = TEXTURE_STATE_IDS["NORMAL"]
+        self.tick = 0
+        self.frames = self.keyframes(row_distance)
+
+    @classmethod
+    def keyframes(cls, row_distance):
+        if row_distance not in cls.tables:
+            frames = []
+            # Falling, half a row every 5 updates
             for n in range(row_distance*10):
-                if n % 5 == 0:
-                    self.row -= 0.5
-                yield
-            for i in range(2):
-                self.state = TEXTURE_STATE_IDS["NORMAL"]
-                for n in range(5):
-                    yield
-                self.state = TEXTURE_STATE_IDS["SQUISH2"]
-                for n in range(15):
-                    yield
-                self.state = TEXTURE_STATE_IDS["NORMAL"]
-                for n in range(5):
-                    yield
-                self.state = TEXTURE_STATE_IDS["SQUISH1"]
-                for n in range(10):
-                    yield
-            self.state = TEXTURE_STATE_IDS["NORMAL"]
-            for n in range(5):
-                yield
-            self.state = TEXTURE_STATE_IDS["SQUISH2"]
-            for n in range(10):
-                yield
-            self.state = TEXTURE_STATE_IDS["NORMAL"]
-            for n in range(5):
-                yield
-            self.state = TEXTURE_STATE_IDS["SQUISH1"]
-            for n in range(5):
-                yield
-            self.state = TEXTURE_STATE_IDS["NORMAL"]
-            for n in range(5):
-                yield
-            self.state = TEXTURE_STATE_IDS["SQUISH2"]
-            for n in range(30):
-                yield
-
-        self.position = position()
+                frames.append((0.5*(n//5+1), TEXTURE_STATE_IDS["NORMAL"]))
+            # Then squishing where it landed
+            for state, length in GRAVITY_SQUISH:
+                frames += [(row_distance, TEXTURE_STATE_IDS[state])]*length
+            cls.tables[row_distance] = tuple(frames)
+        return cls.tables[row_distance]
+
+    def advance(self):
+        # Moves the animation on by one update, returns False once it's finished
+        if self.tick == len(self.frames):
+            return False
+        fallen, self.state = self.frames[self.tick]
+        self.row = self.start-fallen
+        self.tick += 1
+        return True
 
 # FallingBean is not an entity
 # It has an update method, but this is simply called by the grid
@@ -761,16 +747,24 @@ class FallingBean:
         
 # InputHandler is an Entity
 class InputHandler(Entity):
-    def __init__(self, engine, scene, id):
+    # Every update's state and rotation are recorded, one byte each, so a game can be played again exactly with the same seed
+    # replay is a recording to play back instead of reading the keyboard, once it runs out nothing is pressed
+    def __init__(self, engine, scene, id, replay=None):
         super().__init__(engine, scene, id)
         self.state = ACTION_IDS["NOTHING"]
         self.direction = 0
         self.rotation = 0
+        self.replay = replay
+        self.recording = bytearray()
 
     def render(self):
         # While nothing is currently visible this could easily be used for something that displays what keys are currently being pressed
         pass
 
+    def dirty(self):
+        # Nothing is drawn so nothing ever changes
+        return []
+
     def get_inputs(self):
         self.left = False
         self.right = False
@@ -800,8 +794,28 @@ class InputHandler(Entity):
             self.down = True
 
     def update(self):
-        self.get_inputs()
+        if self.replay is None:
+            self.get_inputs()
+            self.resolve_inputs()
+        else:
+            self.play()
+        self.recording.append(self.pack(self.state, self.rotation))
+
+    # The state fits in the bottom 3 bits and the rotation, plus 1 so it isn't negative, in the 2 bits above that
 
+    @staticmethod
+    def pack(state, rotation):
+        return state | (rotation+1) << 3
+
+    @staticmethod
+    def unpack(x):
+        return x & 0b111, (x >> 3)-1
+
+    def play(self):
+        tick = len(self.recording)
+        self.state, self.rotation = self.unpack(self.replay[tick]) if tick < len(self.replay) else (ACTION_IDS["NOTHING"], 0)
+
+    def resolve_inputs(self):
         # You get output from two different attributes, rotation and state, because those two things can happen simultaneously, with rotation taking priority
 
         # If both rotation button are pressed then they cancel out
@@ -874,14 +888,24 @@ class Score(Entity):
         self.font = self.engine.get_asset("ComicMono.ttf", font=40)
         self.score = 0
         self.text = "000000000" # Due to the ability to display calculations text has to be controlled separately
+        self.drawn = None # The text on screen last frame, for dirty rects
 
     def update(self):
         pass
     
     def render(self):
-        text = self.font.render(self.text, True, 0xffffffff)
+        text = self.font.render(self.drawn or self.text, True, 0xffffffff)
         self.engine.screen.blit(text, (0.4*self.engine.width, 0.5*self.engine.height))
 
+    def dirty(self):
+        # The text needs redrawing when it changes, covering both the old and new text in case one is longer
+        if self.text == self.drawn:
+            return []
+        position = (0.4*self.engine.width, 0.5*self.engine.height)
+        rects = [pygame.Rect(position, self.font.size(x)) for x in (self.text, self.drawn) if x is not None]
+        self.drawn = self.text
+        return rects
+
     def output_top_scores(self):
         # Read scores from text files, split by new lines, sort them and print out the top 5
         with open("scores.txt", "r") as f:
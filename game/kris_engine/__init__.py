@@ -7,8 +7,6 @@ import os
 # My own module for outputting coloured text in the console using ANSI escape codes
 # Much of the code was written by another student so will not be included in the Technical Solution
 from kris_engine.colour import Colour
-# Used for global except hook and dumping to stdout
-import sys
 # Used for managing threading
 import threading
 # Used for running function on program termination
@@ -17,9 +15,19 @@ import atexit
 import time
 # Used to assign random text colour to an unidentified thread
 import random
+# Used for the pool of threads that prefetch assets for upcoming scenes
+from concurrent.futures import ThreadPoolExecutor
+# Used to pass events from the main thread to the update thread
+from collections import deque
 # A module of my own creation used to load textures from a custom file type
 # See files.py for documentation around this
 import kris_engine.files
+# The cache that get_asset stores assets in, see cache.py
+from kris_engine.cache import AssetCache
+# My own logging module, which writes log messages on its own thread, see log.py
+from kris_engine.log import Log, DEBUG, INFO, WARNING, ERROR
+# Times how long each entity takes to update and render, shown with F3, see profiler.py
+from kris_engine.profiler import Profiler
 
 # Defining the main engine class
 # When an Engine object is initialised, it will loop forever until something causes self.running to become False
@@ -30,7 +38,14 @@ class Engine:
     # engine_path represents where the folder that the engine is stored in is relative to where the program is being run. So here, the program from the directory where the engine is stored, and it must be specified if it is not.
     # log_path is the same as engine path but specifically refers to where the log file is stored
     # texture_quality refers to the resolution of the texture that is loaded, as loading maximum quality texture can often require gigabytes of RAM. Only applies to images currently, uses the texture quality feature of KAP files from the files module.
-    # log_max_size is the maximum size that the log file can be in bytes, defaulting to 10MB
+    # log_max_size is the maximum size that the log file can be in bytes, defaulting to 10MB. Once it's bigger, it's renamed to end in .1 and a new log file is started
+    # log_level is the least important messages that are logged, one of DEBUG, INFO, WARNING or ERROR. DEBUG includes every file loaded from a KAP file
+    # cache_budget is roughly how many bytes of memory loaded assets are allowed to take up before the least recently used ones are thrown away, defaulting to 1GB. 0 means no limit. Assets the current scene lists in load_with_pbar are never thrown away, so a warning is logged if those alone are over budget, ExerciseClassic's raw bean textures take up about 550MB.
+    # prefetch_threads is the number of threads used by prefetch to load assets for upcoming scenes in the background
+    # load_threads is the number of threads the progress bar uses to load a scene's assets, None means one per CPU
+    # profile records how long every entity's update and render takes each frame, press F3 to see it. It can be True, or a file path ending in .csv or .json to also save a trace there when the engine closes, see profiler.py
+    # headless runs without a window, sound or any threads of its own, for tests and simulations. The constructor returns once the scene is loaded, then updates are done with step or run and frames are drawn offscreen with render. Call quit when finished
+    # lazy_kap opens KAP files without reading their whole directory, files in them are looked up the first time they're loaded instead. Useful for huge KAP files, see load_kap in files.py
     # *args and **kwargs are the arguments and keyword arguments for initialising the scene passed into the scene keyword
     def __init__(self, *args,
         scene=None,
@@ -40,6 +55,13 @@ class Engine:
         log_path = "kris_engine/engine_log.txt",
         texture_quality = "high",
         log_max_size = 10000000,
+        log_level = INFO,
+        cache_budget = 1073741824,
+        prefetch_threads = 2,
+        load_threads = None,
+        lazy_kap = False,
+        profile = False,
+        headless = False,
         **kwargs):
 
         # If a scene is passed in, load that scene. Else, load the default scene defined by the Scene class.
@@ -63,6 +85,14 @@ class Engine:
         self.__log_path = log_path
         self.__texture_quality = texture_quality
         self.__log_max_size = log_max_size
+        self.__log_level = log_level
+        self.__lazy_kap = lazy_kap
+        self.__load_threads = load_threads or os.cpu_count() or 1
+        self.__headless = headless
+
+        # None when not profiling, so checking it is as cheap as possible
+        self.profiler = None
+        self.__profile = profile
 
         # Counter for generating unique integers, see the id property
         self.__id = 0
@@ -75,12 +105,19 @@ class Engine:
 
         # Attibutes used to store the last time a message saying that the update or render threads were behind was sent so that the console doesn't get spammed
         self.lag, self.lag2 = time.perf_counter(), time.perf_counter()
+        # How much longer than asked time.sleep usually takes, see wait_until
+        self.__oversleep = 0.001
 
         # self.event_gotten is an attibute used to synchronise the fetching of pygame events on the main thread and the rendering of frames on the render thread.
         # This is because events must be gotten once per frame.
+        # The render thread sets it to False after each frame and the main thread sets it to True once it's got the events, each notifying the other through self.frame_condition so neither has to keep checking
         self.event_gotten = True
+        self.frame_condition = threading.Condition()
 
         self.append_log("Initialising pygame...")
+        if self.headless: # SDL's dummy drivers don't open a window or play anything but otherwise work as normal
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
         pygame.init()   
 
         self.append_log("Loading default assets...")
@@ -91,13 +128,27 @@ class Engine:
 
         # Loads the KAP file containing default assets. These are used if an asset is not found.
         # KAP files contain assets. To learn more about them, look at files.py
-        self.kap = kris_engine.files.KAP(self.engine_path+"/default.kap", engine=self)
-        # Fonts are stored in the font assets dictionary due to the need to store different font sizes, and all other assets (audio, textures) are stored in the assets dictionary
-        self.assets, self.font_assets = {}, {}
+        self.kap = kris_engine.files.KAP(self.engine_path+"/default.kap", engine=self, lazy=self.lazy_kap)
+        # All assets are cached through get_asset. Keys are ("audio", path), ("font", path, size) or ("image", path, scale)
+        self.cache = AssetCache(cache_budget, engine=self)
+        if self.__profile:
+            self.profiler = Profiler(self)
+        # Threads that load assets for scenes that are coming up next, see prefetch
+        self.__prefetch_pool = ThreadPoolExecutor(max_workers=prefetch_threads)
+        # Scene classes that are being prefetched, with a dictionary of {path: future} for each
+        self.__prefetching = {}
         
         # Used for storing pygame events
+        # The main thread adds events to the right of event_queue, and each update takes everything in it from the left into self.events, the events for that update
+        # Adding and taking from different ends of a deque is safe from different threads without a lock, and doesn't copy anything
+        self.event_queue = deque()
         self.events = []
 
+        # Regions of the screen that need redrawing in dirty rect mode, see mark_dirty
+        # None in this list means the whole screen, which is always the case for the first frame of a scene
+        self.__dirty = [None]
+        self.__dirty_lock = threading.Lock()
+
         # Ordered list of all loaded entities, order decides rendering and updating order
         self.__entities = []
         # The key is a unique integer ID and the value is an entity object
@@ -106,9 +157,17 @@ class Engine:
         # Create window
         self.append_log(f"Creating window, (width, height) = ({self.width}, {self.height})")
         self.screen = pygame.display.set_mode((self.width,self.height))
+        # The pixel format images are converted to, see check_display_format
+        self.display_format = (self.screen.get_bitsize(), self.screen.get_masks())
         # Set window title
         pygame.display.set_caption("Kris's Engine")
         
+        # In headless mode the caller does the updating and rendering, so there are no threads and nothing to wait for
+        if self.headless:
+            self.append_log("Loading scene...")
+            self.load_scene(scene, *args, **kwargs)
+            return
+
         self.append_log("Spawning threads...")
         self.__update_thread = threading.Thread(target=self.update_loop)
         self.__update_thread.start()
@@ -117,58 +176,75 @@ class Engine:
         self.append_log("Loading scene...")
         self.load_scene(scene, *args, **kwargs)
 
-        # Pygame is weird and getting events must be done on the main thread. The event_gotten attribute is set to False every frame and True every time events are fetched. Pygame will crash if events are not gotten every frame so this attribute prevents a frame from proceeding before events are collected, however this should be hardly needed as there is a sleep statement to sync it with the framerate. The subtraction of 1ms is to account for the time it take to run the get events function.
+        # Pygame is weird and getting events must be done on the main thread. The event_gotten attribute is set to False every frame and True every time events are fetched. Pygame will crash if events are not gotten every frame so this attribute prevents a frame from proceeding before events are collected.
+        # The main thread sleeps until the render thread finishes a frame, or at most 50ms so that the window still responds while a scene is loading and nothing is being rendered
         while self.running:
+            with self.frame_condition:
+                self.frame_condition.wait_for(lambda: not self.event_gotten or not self.running, timeout=0.05)
             self.get_events()
-            self.event_gotten = True
-            if self.render_rate != 0:
-                time.sleep((1/self.render_rate)-0.001)
+            with self.frame_condition:
+                self.event_gotten = True
+                self.frame_condition.notify_all()
+        self.quit()
+
+    def quit(self):
+        # Shuts the engine down, this happens when the window is closed, or should be called when you're done with a headless engine
+        self.running = False
+        # Make sure nothing is still loading assets when pygame is shut down
+        self.cancel_prefetch()
+        self.__prefetch_pool.shutdown()
         pygame.quit()
+        if isinstance(self.__profile, str):
+            self.profiler.export(self.__profile)
+
+    def step(self, n=1):
+        # Headless mode, does n updates straight away, however long they take
+        # Events are still fetched first, so events added with pygame.event.post reach the entities
+        for x in range(n):
+            if not self.running:
+                break
+            self.get_events()
+            self.tick()
+        return self.update_counter
+
+    def run(self, n=None):
+        # Headless mode, does updates as fast as possible until the engine stops running, or until n updates have been done if n is given
+        # Returns the number of updates done
+        start = self.update_counter
+        while self.running and (n is None or self.update_counter-start < n):
+            self.get_events()
+            self.tick()
+        return self.update_counter-start
+
+    def render(self):
+        # Headless mode, draws a frame onto self.screen, which is offscreen, and returns it
+        self.render_counter += 1
+        self.check_display_format()
+        self.render_scene()
+        if self.profiler:
+            self.profiler.end_frame()
+        return self.screen
 
     def init_log(self):
-        self.__start_time = time.perf_counter() # Used for calculating how long the program has been running
         # Use the built in thread ID system to assign colours to threads
         self.threads = {threading.get_ident(): {"colour": Colour(0xff00ff), "name": "Main"}}
-        # The coloured thing we flush to the console
-        self.__console_log = Colour(0xff00ff)+"Welcome to Kris's Engine!\n"
-        # The thing we dump to a text file
-        self.__full_log = "Welcome to Kris's Engine!\n"
-        self.log_loop = 0.5 # Number of seconds between dumping to console
-        atexit.register(self.exit_log) # Log will be saved on termination
-        threading.Thread(target=self.loop_log).start() # Create logging thread
-
-    def loop_log(self):
-        # Assign a colour to the logging thread
-        self.threads[threading.get_ident()] = {"colour": Colour(0x10ebe1), "name": "Logging"}
-        self.append_log(f"Logging thread initialised at {time.time()}")
-        while self.running:
-            sys.stdout.write(self.__console_log) # Flush to console, faster than print!
-            self.__console_log = "" # Clear console log
-            time.sleep(self.log_loop) # Wait. Note this only pauses this logging thread, not other threads
-
-    def exit_log(self): # Dump log to text file on program termination
-        try: # Try and read from the file and trim the front from it to comply with the maximum log size
-            with open(self.log_path, "r") as f:
-                log = f.read()
-            log += self.__full_log + "\n"
-            with open(self.log_path, "w") as f:
-                f.write(log[-self.__log_max_size:])
-        except FileNotFoundError: # If the log doesn't exist just write what we have
-            with open(self.__log_path, "w") as f:
-                f.write(self.__full_log)
-
-    def append_log(self, message, name="Unknown"):
+        # The log writes messages to the console and log file on its own thread, see log.py
+        self.log = Log(self.log_path, self.__log_max_size, self.threads, level=self.__log_level)
+        atexit.register(self.log.close) # Everything left in the log will be written on termination
+        self.append_log("Logging thread initialised at %s", time.time())
+
+    def append_log(self, message, *args, name="Unknown", level=INFO):
+        # Messages below the log level are thrown away straight away, before anything is formatted
+        # If args are given the message is formatted as message % args by the logging thread, so a message that is thrown away or logged often costs almost nothing
+        if level < self.log.level:
+            return
         # Get information about the thread that the logging request is being made from
         # Pick a colour if we don't know about it
         # Name is only used the first time a thread is started, to give it a name, otherwise it is ignored
         t = threading.get_ident()
         if t not in self.threads:
             self.threads[t] = {"colour": Colour(random.randint(0, (2**24)-1)), "name": name}
-        thread = self.threads[t]
-        # Only call time function once so time is consistent across logs
-        name_and_time = f"{thread['name']} thread at {time.perf_counter()-self.__start_time}"
-        self.__console_log += f"{thread['colour']}[{name_and_time}] {Colour(0xffffff)}{message}\n"
-        self.__full_log += f"[{name_and_time}] {message}\n"
+        self.log.put(message, args, level)
 
     # reads from config file, converts json to dictionary, sets config attribute to data and returns data
     def load_config(self):
@@ -194,7 +270,20 @@ class Engine:
         for x in pygame.event.get():
             if x.type == pygame.QUIT:
                 self.running = False
-            self.events.append(x)
+            # If the window was covered up or minimised then what's on screen is lost, so everything needs redrawing
+            elif x.type == pygame.VIDEOEXPOSE or x.type == pygame.WINDOWEXPOSED:
+                self.mark_dirty()
+            # F3 shows or hides the profiler overlay
+            elif x.type == pygame.KEYDOWN and x.key == pygame.K_F3 and self.profiler:
+                self.profiler.overlay = not self.profiler.overlay
+                self.mark_dirty()
+            self.event_queue.append(x)
+
+    def mark_dirty(self, rect=None):
+        # Asks for a region of the screen to be redrawn next frame in dirty rect mode, or the whole screen if rect is None
+        # Entities should normally report what they've changed through their dirty method instead, this is for anything else
+        with self.__dirty_lock:
+            self.__dirty.append(None if rect is None else pygame.Rect(rect))
 
     # All assets should always be gotten through get_asset so they can be cached
     # This prevents a rookie developer from making the mistake of loading a file every frame
@@ -203,62 +292,66 @@ class Engine:
     # path represents the name of the texture, note that this does not refer to a real file but the name of a file in a loaded KAP file
     # If audio is set to true, then an audio file is loaded. If a font size is specifies, a font of that size is loaded. Otherwise, an image is loaded
     # More details on the contents of scale are given at the __scale function
-    def get_asset(self, path, audio=False, font=0, scale="raw"):
+    # If strict is True then an asset that fails to load raises the error instead of being replaced, this is used when preloading so the progress bar can count what failed
+    def get_asset(self, path, audio=False, font=0, scale="raw", strict=False):
         # If we are loading an audio file
         if audio:
-            try: # If it's in the cache, return it, otherwise
-                return self.assets[path]
-            except:
-                try: # Load it as a pygame Sound object and assign it to the cache then return it
-                    self.assets[path] = pygame.mixer.Sound(self.kap.load(path, engine=self))
-                    return self.assets[path]
-                except: # If it failed to load, output an error message and call this function again but getting missing.ogg as a replacement
-                    # Note that if default.kap is missing this will recursively error as the engine is not installed properly
-                    self.append_log(f"Error! Asset {path} was not found! Is your required KAP file loaded?")
-                    return self.get_asset("missing.ogg", audio=True)
+            # If it's in the cache, return it
+            if (asset := self.cache.get(("audio", path))) is not None:
+                return asset
+            try: # Otherwise load it as a pygame Sound object and assign it to the cache then return it
+                asset = pygame.mixer.Sound(self.kap.load(path, engine=self))
+            except: # If it failed to load, output an error message and call this function again but getting missing.ogg as a replacement
+                if strict:
+                    raise
+                # Note that if default.kap is missing this will recursively error as the engine is not installed properly
+                # The replacement is cached under this path too, like missing.png is for images, so the error is only logged once
+                self.append_log(f"Error! Asset {path} was not found! Is your required KAP file loaded?", level=ERROR)
+                asset = self.get_asset("missing.ogg", audio=True)
+            self.cache.put(("audio", path), asset)
+            return asset
 
         # If we are loading a font of a given size font
         if font:
-            try: # See if that font size is in the cache and return it
-                return self.font_assets[path][font]
-            except:
-                try:
-                    try: # See if that font is loaded into the cache at all
-                        self.font_assets[path]
-                    except:
-                        self.font_assets[path] = {} # If it isn't loaded into the cache, we store a dictionary at that path name
-                        # This dictionary has font sizes as keys
-                    # We then load in the font at the desired size, store it in cache and return it
-                    self.font_assets[path][font] = pygame.font.Font(self.kap.load(path, engine=self), font)
-                    return self.font_assets[path][font]
-                except: # If it failed to load, output an error message and call this function again but getting ComicMono.ttf at the same font size as a replacement
-                    # Note that if default.kap is missing this will recursively error as the engine is not installed properly
-                    self.append_log(f"Error! Asset {path} was not found! Is your required KAP file loaded?")
-                    return self.get_asset("ComicMono.ttf", font=font)
+            # See if that font size is in the cache and return it
+            if (asset := self.cache.get(("font", path, font))) is not None:
+                return asset
+            try: # We then load in the font at the desired size, store it in cache and return it
+                asset = pygame.font.Font(self.kap.load(path, engine=self), font)
+            except: # If it failed to load, output an error message and call this function again but getting ComicMono.ttf at the same font size as a replacement
+                if strict:
+                    raise
+                # Note that if default.kap is missing this will recursively error as the engine is not installed properly
+                self.append_log(f"Error! Asset {path} was not found! Is your required KAP file loaded?", level=ERROR)
+                return self.get_asset("ComicMono.ttf", font=font)
+            # pygame can't tell us how big a font is in memory, so we go by the size of its file
+            self.cache.put(("font", path, font), asset, size=self.__size(path))
+            return asset
 
         # If it's not a font or an audio file then it's an image (that's everything that is supported)
-        try: # See if it's in cache or not
-            self.assets[path]
-        except: # We use a dictionary again but this time with different scaling factors as keys
-            self.assets[path] = {}
-        try: # If we already have this scale in cache then return it
-            return self.assets[path][scale]
-        except: # Otherwise, we call the scaling function. Yes, even if the scale is raw, we let the function handle it.
-            self.assets[path][scale] = self.__scale(scale, path)
-            return self.assets[path][scale]
-
-    def __scale(self, scale, path):
+        # Different scaling factors are cached separately
+        if (asset := self.cache.get(("image", path, scale))) is not None:
+            return asset
+        # Otherwise, we call the scaling function. Yes, even if the scale is raw, we let the function handle it.
+        asset = self.__scale(scale, path, strict)
+        self.cache.put(("image", path, scale), asset)
+        return asset
+
+    def __scale(self, scale, path, strict=False):
         # scale can be three things: the string "raw", a tuple of width and height floats, or a float
         # The float represents maintaining the original aspect ratio of the texture but scaling it so that the height equals the provided float multipled by the height of the engine's window
         # If we got this far and the scale is raw thaen we actually need to load it, and all scales are transformations of this raw image
         if scale == "raw":
             try: # Try and load the image as a surface object
-                return pygame.image.load(self.kap.load(path, quality=self.texture_quality, engine=self))
+                surface = pygame.image.load(self.kap.load(path, quality=self.texture_quality, engine=self))
             except: # If we can't find it, load the default missing.png
-                self.append_log(f"Error! Asset {path} was not found! Is your required KAP file loaded?")
+                if strict:
+                    raise
+                self.append_log(f"Error! Asset {path} was not found! Is your required KAP file loaded?", level=ERROR)
                 return self.get_asset("missing.png")
-        self.append_log(f"Scaling asset {path} with settings {scale}")
-        obj = self.get_asset(path)
+            return self.convert(surface)
+        self.append_log("Scaling asset %s with settings %s", path, scale, level=DEBUG)
+        obj = self.get_asset(path, strict=strict)
         if isinstance(scale, tuple):
             # Just in case someone decided to not follow my instructions, ensures tuple of size 2
             if len(scale) == 1:
@@ -271,6 +364,29 @@ class Engine:
         # Now in both cases we have a tuple of length two with target pixel values
         return pygame.transform.scale(obj, scale)
 
+    def convert(self, surface):
+        # Converts a surface to the display's pixel format, otherwise pygame converts every pixel every time it's blitted
+        # Images with transparency keep it with convert_alpha, everything else uses convert which also keeps any colour key
+        # Scaled images are made from the raw image so they're already converted
+        if pygame.display.get_surface() is None: # Can't convert before the window exists
+            return surface
+        return surface.convert_alpha() if surface.get_flags() & pygame.SRCALPHA else surface.convert()
+
+    def check_display_format(self):
+        # If the display's pixel format has changed then every cached image is in the wrong format, so they're thrown away and loaded again
+        # Called every frame by the render thread, it's only a couple of comparisons
+        display = pygame.display.get_surface()
+        if display is None:
+            return
+        display_format = (display.get_bitsize(), display.get_masks())
+        if display_format != self.display_format:
+            self.append_log(f"Display format changed to {display_format}, reloading images")
+            self.screen = display
+            self.display_format = display_format
+            self.cache.clear("image")
+            self.cache.clear("layers")
+            self.mark_dirty()
+
     def load_entity(self, entity, scene, *args, **kwargs):
         # While one could theoretically initialise an entity directly, it wouldn't do anything without the engine having ownership of it
         # So the parameter name entity is slightly misleading, as you actually pass in the uninitialised class as a type object
@@ -294,6 +410,8 @@ class Engine:
         # Python will return an error if the object does not exist.
         self.__entities.remove(entity)
         del self.entity_id[entity.id]
+        # Whatever it drew is still on screen in dirty rect mode
+        self.mark_dirty()
 
     def load_scene(self, scene, *args, pbar=True, **kwargs):
         # Similar to load_entity, scene should not be an initialised scene but instead the class of the scene to be initialised
@@ -304,10 +422,17 @@ class Engine:
         # Verifies that the class being passed in inherits from the Scene class
         if Scene not in scene.__mro__:
             raise TypeError("Invalid scene was blocked!")
+        # The assets a scene asks for are pinned in the cache so they aren't thrown away while the scene is running
+        # The progress bar scene is only there to load another scene's assets, so it keeps that scene's pins
+        if scene is not kris_engine.pbar.Pbar:
+            # Composited layers are cached with the tuple of layers in place of a path, see get_layers
+            self.cache.pinned = set(scene.load_with_pbar) | {tuple(scene.layers), tuple(scene.overlays)}
+            # Anything that was being prefetched for a different scene isn't needed any more
+            self.cancel_prefetch(keep=scene)
         for x in scene.kap: # A scene should specify the KAP files it needs to be loaded
             # These files will already be loaded if they are not loaded already, so if multiple scenes need the same KAP file there is no reason to not list those KAP files in every scene
             if x not in self.kap.open:
-                self.kap.load_kap(x, engine=self)
+                self.kap.load_kap(x, engine=self, lazy=self.lazy_kap)
         # Destroy all non-persistant entities
         for x in self.__entities:
             if not x.persist:
@@ -315,11 +440,12 @@ class Engine:
         # If pbar is enabled by the keyword parameter, and the scene has assets to load by pbar, then we call this function again to load the pbar class
         # This rudimentary implementation loads textures in their raw form, perhaps later I will implement the ability to scale with a progress bar
         # More information about the progress bar scene can be found in pbar.py
-        if pbar and scene.load_with_pbar:
+        # If everything the scene needs was already loaded, for example by prefetch, then there's no need for the pbar
+        # There's nothing to show a progress bar on in headless mode, assets are loaded when they're first used instead
+        if pbar and not self.headless and scene.load_with_pbar and not all(self.is_loaded(x) for x in scene.load_with_pbar):
             self.load_scene(kris_engine.pbar.Pbar,
             # Function to get audio and image files
-            # Pbar loading does not support fonts as fonts are always scaled to a given size, there is no raw form
-            lambda x: self.get_asset(x, **({"audio": True} if x[-3:] == "ogg" or x[-3:] == "wav" else {})),
+            self.preload,
             scene.load_with_pbar,
             # Calls a function to get the size of files
             # This allows for the pbar to be incremented a different amount depending on the size of the file being loaded
@@ -332,20 +458,81 @@ class Engine:
             # Grab information from the scene and initialise a scene object.
             self.update_rate, self.render_rate = scene.update_rate, scene.render_rate
             self.scene = scene(self, *args, **kwargs)
+            # The scene has loaded, so it's not being prefetched any more
+            self.__prefetching.pop(scene, None)
             self.update_counter, self.render_counter = 0, 0
             # Loop the music infinitely
             if self.scene.music:
                 self.scene.music().play(loops=-1)
+            # The new scene has to be drawn in full before only drawing the parts that change
+            self.mark_dirty()
             # Reset timers
             self.scene_time = time.perf_counter()
+            # The time that updates are counted from, this moves forward if updates fall too far behind, see update_loop
+            self.update_time = self.scene_time
             self.lag, self.lag2 = time.perf_counter(), time.perf_counter()
             # Allow updates and rendering to process
             self.ready = True
 
+    def preload(self, path):
+        # Loads an image or audio file in its raw form into the cache
+        # Pbar loading does not support fonts as fonts are always scaled to a given size, there is no raw form
+        # Raises the error if the file can't be loaded, so the progress bar can report it, getting it with get_asset afterwards gives the replacement as usual
+        # If the file is already being prefetched, waits for that instead of loading it twice
+        for x in list(self.__prefetching.values()):
+            if (future := x.get(path)) and not future.cancelled():
+                return future.result()
+        return self.__load_raw(path)
+
+    def __load_raw(self, path):
+        return self.get_asset(path, strict=True, **({"audio": True} if path[-3:] == "ogg" or path[-3:] == "wav" else {}))
+
+    def is_loaded(self, path):
+        # Whether preload would get a file straight from the cache
+        return (("audio", path) if path[-3:] == "ogg" or path[-3:] == "wav" else ("image", path, "raw")) in self.cache
+
+    def prefetch(self, scene):
+        # Starts loading a scene's KAP files and the assets in its load_with_pbar in the background while the current scene keeps running
+        # Returns a list of futures, one for each asset in load_with_pbar, whose results are the loaded assets, or that raise the error if one couldn't be loaded
+        # When the scene is loaded with load_scene it won't need a progress bar if everything has finished loading
+        # If a different scene is loaded first, any assets that haven't started loading yet are cancelled
+        if Scene not in scene.__mro__:
+            raise TypeError("Invalid scene was blocked!")
+        self.append_log(f"Prefetching scene {scene}")
+        for x in scene.kap:
+            if x not in self.kap.open:
+                self.kap.load_kap(x, engine=self, lazy=self.lazy_kap)
+        # Keep the assets in the cache until the scene is loaded
+        self.cache.pinned = self.cache.pinned | set(scene.load_with_pbar)
+        futures = self.__prefetching.setdefault(scene, {})
+        for x in scene.load_with_pbar:
+            if x not in futures:
+                futures[x] = self.__prefetch_pool.submit(self.__prefetch_one, x)
+        return [futures[x] for x in scene.load_with_pbar]
+
+    def __prefetch_one(self, path):
+        # Runs on a prefetch thread
+        if threading.get_ident() not in self.threads:
+            self.threads[threading.get_ident()] = {"colour": Colour(0xa05cff), "name": "Prefetch"}
+        if not self.running:
+            return None
+        return self.__load_raw(path)
+
+    def cancel_prefetch(self, keep=None):
+        # Cancels every prefetch that hasn't started yet, except for the scene keep
+        # Assets that are already loading will finish and stay in the cache until they're evicted
+        for scene in list(self.__prefetching):
+            if scene is not keep:
+                for x in self.__prefetching.pop(scene).values():
+                    x.cancel()
+
     def __size(self, x):
         # Gets information about a file's size from KAP file header. Returns raw size or size of given texture quality if available
         # It may be worth noting that the size being used for the pbar is the compressed size of the file, not it's uncompressed size
-        try: return self.kap.assets[x][1] if type(self.kap.assets[x]) == tuple else self.kap.assets[x][self.texture_quality][1]
+        # The entry is looked up once, as it can mean searching the header of a lazily opened KAP file
+        try:
+            entry = self.kap.entry(x)
+            return entry[1] if type(entry) == tuple else entry[self.texture_quality][1]
         except: return 0
 
     def update_loop(self):
@@ -355,26 +542,61 @@ class Engine:
         self.append_log("Update thread started!")
         while self.running: # The thread will continue until every entity has been updated. Simply the most convenient way to implement it
             if self.ready: # If updates are allowed to proceed, otherwise do nothing
-                self.update_counter += 1
-                event = len(self.events)
-                # Go through list of entities in order
-                for e in self.__entities:
-                    e.update()
-                # All events are appended to self.events by the main thread
-                # But it's the update thread that actually needs them so this means the events will be processed in the update then removed
-                self.events = self.events[event:]
-                t = time.perf_counter()
-                # "How long do I have to wait to limit the rate of updates"
-                # Except a millisecond less actually because it's better to do an update early than late
-                s = (self.update_counter/self.update_rate)-(t-self.scene_time)-0.001
-                if s > 0:
-                    time.sleep(s) # wait
-                # If it's negative then oh no we're behind
-                elif self.lag2+2 < t:  # Explained earlier, no console spam
-                    x = int(self.update_rate*-s)
-                    if x > self.update_rate/20: # If we're less than 0.05 seconds behind why even bother
-                        self.append_log(f"Warning! Update was {round(-s*1000, 1)}ms behind! {x+1} updates behind!")
-                        self.lag2 = time.perf_counter()
+                # Updates happen at fixed times, update_rate times a second since update_time, so the game runs at the same speed no matter how fast the computer is
+                # "How many updates should have happened by now"
+                behind = int((time.perf_counter()-self.update_time)*self.update_rate)-self.update_counter
+                if behind <= 0:
+                    # Ahead, so wait until the next update is due
+                    self.wait_until(self.update_time+(self.update_counter+1)/self.update_rate)
+                    continue
+                # If we've fallen behind then updates are done back to back to catch up, but only up to max_catch_up of them
+                # Any more than that and the time is skipped instead, the game slows down for a moment rather than getting further and further behind
+                max_catch_up = self.scene.max_catch_up or max(1, self.update_rate//10)
+                if behind > max_catch_up:
+                    self.update_time += (behind-max_catch_up)/self.update_rate
+                    t = time.perf_counter()
+                    if self.lag2+2 < t: # Explained earlier, no console spam
+                        self.append_log(f"Warning! Updates were {round((behind-max_catch_up)/self.update_rate*1000, 1)}ms behind! Skipped {behind-max_catch_up} updates!", level=WARNING)
+                        self.lag2 = t
+                    behind = max_catch_up
+                for x in range(behind):
+                    if not (self.ready and self.running): # A new scene might be loading
+                        break
+                    self.tick()
+
+    def tick(self):
+        # Updates every entity once
+        self.update_counter += 1
+        # All events are added to event_queue by the main thread
+        # But it's the update thread that actually needs them, so every event that has arrived since the last update is handed over for this update
+        events = []
+        while self.event_queue:
+            events.append(self.event_queue.popleft())
+        self.events = events
+        # Go through list of entities in order
+        if self.profiler:
+            self.profiler.update(self.__entities)
+        else:
+            for e in self.__entities:
+                e.update()
+
+    @property
+    def interpolation(self):
+        # How far the current time is between the last update and the next one, from 0 to 1
+        # Entities can use this in render to draw things that move smoothly in between updates
+        return min(max((time.perf_counter()-self.update_time)*self.update_rate-self.update_counter, 0), 1)
+
+    def wait_until(self, target):
+        # Waits until time.perf_counter() reaches target
+        # time.sleep usually takes a bit longer than asked, so it sleeps for less than needed by how much it's been oversleeping and then spins for the rest
+        # How much it oversleeps is measured every time so that it's right for whatever computer it's running on
+        sleep = target-time.perf_counter()-self.__oversleep
+        if sleep > 0:
+            start = time.perf_counter()
+            time.sleep(sleep)
+            self.__oversleep = max(0.9*self.__oversleep + 0.1*(time.perf_counter()-start-sleep), 0)
+        while time.perf_counter() < target:
+            time.sleep(0) # Lets other threads run while spinning
 
     def render_loop(self):
         # The function that is executed by the update threads
@@ -384,29 +606,116 @@ class Engine:
         while self.running: # The thread will continue until every entity has been rendered and the frame updated. Simply the most convenient way to implement it
             if self.ready: # If rendering is allowed to proceed, otherwise do nothing
                 self.render_counter += 1
-                # Draw a scene's background, pygame applications typically wipe the entire screen every frame
-                self.scene.background()
-                # Go through list of entities in order
-                for x in self.__entities:
-                    x.render()
-                while not self.event_gotten: # Wait for the main thread to get events
-                    time.sleep(0.001)
-                pygame.display.update() # Draw the next frame on screen
-                self.event_gotten = False # Tell the main thread to get the next updates
+                self.check_display_format()
+                if self.profiler and self.profiler.overlay: # The overlay changes every frame
+                    self.mark_dirty(self.profiler.rect)
+                # In dirty rect mode only the parts of the screen that changed are redrawn, None means the whole screen
+                rects = self.dirty_regions() if self.scene.dirty_rects else None
+                if rects is None:
+                    self.render_scene()
+                else:
+                    # Everything is drawn as usual but clipped to each region, so the background and anything drawn on top of the changed entities comes back too
+                    for rect in rects:
+                        self.screen.set_clip(rect)
+                        self.render_scene()
+                    self.screen.set_clip(None)
+                with self.frame_condition: # Wait for the main thread to get events
+                    self.frame_condition.wait_for(lambda: self.event_gotten or not self.running)
+                t = time.perf_counter()
+                if rects is None:
+                    pygame.display.update() # Draw the next frame on screen
+                elif rects:
+                    pygame.display.update(rects) # Only send the changed regions to the window
+                if self.profiler:
+                    self.profiler.lap("display.update", t)
+                    self.profiler.end_frame()
+                with self.frame_condition: # Tell the main thread to get the next updates
+                    self.event_gotten = False
+                    self.frame_condition.notify_all()
                 t = time.perf_counter()
                 if self.render_rate != 0: # The render thread allows frame rate to be uncapped, in which case we don't need waiting or lag reporting
                     # "How long do I have to wait to limit the frame rate"
-                    # Except a millisecond less actually because it's better to do a frame early than late
-                    s = (self.render_counter/self.render_rate)-(t-self.scene_time)-0.001
+                    s = (self.render_counter/self.render_rate)-(t-self.scene_time)
                     if s > 0:
-                        time.sleep(s)# wait
+                        self.wait_until(t+s) # wait
                     # If it's negative then oh no we're behind
                     elif self.lag+2 < t: # Explained earlier, no console spam
                         x = int(self.render_rate*-s)
                         if x > 10: # If we're less than 10 frames behind why even bother
-                            self.append_log(f"Warning! Frame was {round(-s*1000, 1)}ms behind! {x+1} frames behind target framerate!")
+                            self.append_log(f"Warning! Frame was {round(-s*1000, 1)}ms behind! {x+1} frames behind target framerate!", level=WARNING)
                             self.lag = time.perf_counter()
 
+    def render_scene(self):
+        # When profiling, the time each step takes is recorded, lap records the time since t and returns the current time
+        if p := self.profiler:
+            t = time.perf_counter()
+        # Draw a scene's background, pygame applications typically wipe the entire screen every frame
+        # If the scene has static layers then they're drawn from one precomposited surface instead
+        if self.scene.layers:
+            self.screen.blit(self.get_layers(self.scene.layers), (0, 0))
+        else:
+            self.scene.background()
+        if p:
+            t = p.lap("background", t)
+        # Go through list of entities in order
+        for x in self.__entities:
+            x.render()
+            if p:
+                t = p.lap(f"render {type(x).__name__}", t)
+        # Then anything that goes on top of every entity
+        if self.scene.overlays:
+            self.screen.blit(self.get_layers(self.scene.overlays, alpha=True), (0, 0))
+            if p:
+                t = p.lap("overlays", t)
+        if p and p.overlay:
+            p.draw()
+
+    def get_layers(self, layers, alpha=False):
+        # Draws a list of images on top of each other, each scaled to the size of the window, onto one surface that's converted to the display's pixel format
+        # This means a scene's static background is one quick blit per frame instead of a scale lookup and an alpha blit for every image
+        # If alpha is False the layers are drawn on black and the result is opaque, otherwise the result keeps its transparency so it can go over entities
+        # The result is cached like any other asset, the window size is part of the key and it is thrown away when the texture quality changes
+        key = ("layers", tuple(layers), alpha, (self.width, self.height))
+        if (asset := self.cache.get(key)) is not None:
+            return asset
+        self.append_log(f"Compositing layers {layers}")
+        asset = pygame.Surface((self.width, self.height), pygame.SRCALPHA if alpha else 0)
+        for x in layers:
+            # Scaled straight from the raw image, as there's no need to keep a scaled copy of each layer in the cache too
+            asset.blit(pygame.transform.scale(self.get_asset(x), (self.width, self.height)), (0, 0))
+        asset = asset.convert_alpha() if alpha else asset.convert()
+        self.cache.put(key, asset)
+        return asset
+
+    def dirty_regions(self):
+        # Collects the regions that changed since the last frame from mark_dirty and every entity's dirty method
+        # Returns a list of non-overlapping rects, or None if the whole screen should be redrawn
+        with self.__dirty_lock:
+            rects, self.__dirty = self.__dirty, []
+        # Every entity is asked even if we already know it's a full redraw, as they use this to remember what they drew
+        for x in self.__entities:
+            r = x.dirty()
+            if r is None:
+                rects.append(None)
+            else:
+                rects += r
+        if None in rects:
+            return None
+        screen = self.screen.get_rect()
+        merged = []
+        for rect in rects:
+            rect = pygame.Rect(rect).clip(screen)
+            if not rect.w or not rect.h:
+                continue
+            # Overlapping rects are combined, which can make the combined rect overlap others, so keep going until it doesn't
+            while (i := rect.collidelist(merged)) != -1:
+                rect.union_ip(merged.pop(i))
+            merged.append(rect)
+        # If most of the screen changed it's quicker to just draw all of it once
+        if sum(x.w*x.h for x in merged) > screen.w*screen.h//2:
+            return None
+        return merged
+
     @property # Getter that increments id every time you access the attibute to always produce a unique ID
     def id(self):
         self.__id += 1
@@ -428,6 +737,18 @@ class Engine:
     def log_path(self):
         return self.__log_path
 
+    @property
+    def headless(self):
+        return self.__headless
+
+    @property
+    def lazy_kap(self):
+        return self.__lazy_kap
+
+    @property
+    def load_threads(self):
+        return self.__load_threads
+
     @property
     def texture_quality(self):
         return self.__texture_quality
@@ -435,10 +756,11 @@ class Engine:
     @texture_quality.setter # Setter so that if the texture quality is changed, all the old textures of incorrect quality are flushed from the cache
     def texture_quality(self, a):
         self.append_log(f"Changing texture quality to {a}... this may take a moment")
-        for x in list(self.assets.keys()):
-            if type(self.assets[x]) == dict:
-                del self.assets[x]
+        self.cache.clear("image")
+        self.cache.clear("layers")
         self.__texture_quality = a
+        # Everything on screen was drawn with the old textures
+        self.mark_dirty()
 
 class Entity: # Every entity should inherit from this class
     persist = False # The entity will be destroyed upon loading a new scene
@@ -479,12 +801,28 @@ class Entity: # Every entity should inherit from this class
         # This is because checking if the current entity is the Entity class is more computationally expensive than skipping that check
         # It is additionally worth noting that that this is the function called every frame by the render thread
 
+    def dirty(self):
+        # Only used in scenes with dirty_rects enabled, called every frame by the render thread before anything is rendered
+        # Should return a list of rects (or anything pygame.Rect accepts) covering everywhere this entity's drawing has changed since the last call, including where it used to be
+        # Returning None means that the entity doesn't know, so the whole screen is redrawn, which is the default so entities that don't support it still work
+        return None
+
 class Scene: # Every scene should inherit from this class
     load_with_pbar = [] # The raw versions of the image and audio files in this list will be loaded with a progress bar displayed before the scene is initialised 
     update_rate = 2400 # Updates per second, must be positive integer
     render_rate = 0 # Frames per second, must be positive integer, or 0 for uncapped
+    # The most updates that are done back to back to catch up after falling behind, any further behind and the time is skipped. None means a tenth of a second's worth
+    max_catch_up = None
     # The background function is called every frame before any entities are rendered and is usually used to clear the screen
     background = lambda self: self.engine.screen.fill(0) # Fills the screen with black
+    # Static images that are scaled to the window and drawn on top of each other, in order, as the background instead of calling background
+    # They're composited into one surface once per window size and texture quality, see get_layers
+    layers = ()
+    # The same as layers, but drawn on top of every entity
+    overlays = ()
+    # If True, only the parts of the screen that entities report as changed with their dirty method are redrawn each frame
+    # The background and entities are still drawn in the usual order but clipped to those parts, so every entity in the scene should implement dirty
+    dirty_rects = False
     # The music function should return a pygame sound object that will be looped for the duration of the scene
     # Tem Shop from the Undertale soundtrack belongs to Toby Fox and Materia Collective
     music = lambda self: self.engine.get_asset("tem_shop.ogg", audio=True)
@@ -0,0 +1,63 @@
+import pygame
+# Used to make the atlas surface and rects
+
+class Atlas:
+# Packs lots of small images, scaled to the same settings, into one big surface
+# Drawing from one surface with a precalculated rect is quicker than looking up a separate scaled surface from the cache for every blit
+# names is the list of image paths to pack, scale is the same as the scale parameter of Engine.get_asset
+# The atlas is rebuilt whenever the window size, texture quality or display format changes, as the scaled images would be different
+
+    # Images are placed in rows (shelves) until a row would be wider than this, then a new row is started
+    max_width = 2048
+
+    def __init__(self, engine, names, scale):
+        self.engine = engine
+        self.names = tuple(names)
+        self.scale = scale
+        self.__surface = None
+        self.rects = {} # name: pygame.Rect of that image on the atlas surface
+        self.key = None
+
+    @property
+    def surface(self):
+        # Rebuild first if the settings the atlas was built with are out of date
+        if self.key != (self.engine.width, self.engine.height, self.engine.texture_quality, self.engine.display_format):
+            self.build()
+        return self.__surface
+
+    def build(self):
+        self.key = (self.engine.width, self.engine.height, self.engine.texture_quality, self.engine.display_format)
+        self.engine.append_log(f"Building atlas of {len(self.names)} images with settings {self.scale}")
+        images = {x: self.engine.get_asset(x, scale=self.scale) for x in self.names}
+        # Tallest images first, so that every row is about the same height and less space is wasted
+        order = sorted(self.names, key=lambda x: images[x].get_height(), reverse=True)
+        rects = {}
+        x, y, row_height, width = 0, 0, 0, 0
+        for name in order:
+            w, h = images[name].get_size()
+            if x and x + w > self.max_width:
+                x, y, row_height = 0, y + row_height, 0
+            rects[name] = pygame.Rect(x, y, w, h)
+            x += w
+            row_height = max(row_height, h)
+            width = max(width, x)
+        surface = pygame.Surface((max(width, 1), max(y + row_height, 1)), pygame.SRCALPHA)
+        for name in order:
+            # BLEND_RGBA_MAX onto a fully transparent surface copies the pixels exactly, alpha included
+            surface.blit(images[name], rects[name], special_flags=pygame.BLEND_RGBA_MAX)
+        self.__surface, self.rects = self.engine.convert(surface), rects
+
+    def rect(self, name):
+        # Where an image is on the atlas surface, building the atlas first if needed
+        self.surface
+        return self.rects[name]
+
+    def blit(self, name, position):
+        # Draws one image from the atlas onto the screen
+        surface = self.surface
+        self.engine.screen.blit(surface, position, area=self.rects[name])
+
+    def blits(self, sequence):
+        # Draws many images from the atlas onto the screen in one call, sequence is an iterable of (name, position) tuples
+        surface = self.surface
+        self.engine.screen.blits([(surface, position, self.rects[name]) for name, position in sequence], doreturn=False)
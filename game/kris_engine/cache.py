@@ -0,0 +1,114 @@
+import pygame
+# Used to measure how much memory surfaces and sounds take up
+from collections import OrderedDict
+# Remembers the order that assets were used in, oldest first
+import threading
+# The update, render and progress bar threads all use the cache at the same time
+from kris_engine.log import WARNING
+
+class AssetCache:
+# Stores loaded assets for Engine.get_asset, throwing away whatever was used longest ago once the budget is exceeded
+# Keys are tuples that start with the kind of asset and then the asset's path, for example ("image", "1_1.png", "raw")
+# Every asset has an estimated size in bytes, and budget is the total that the cache tries to stay under, 0 means no limit
+# Assets whose path is in pinned are never thrown away, this is used for the assets the current scene asked for
+# If the pinned assets alone are bigger than the budget the cache can't get back under it, so it stops trying and logs a warning once for that set of pins
+
+    def __init__(self, budget=0, engine=None):
+        self.budget = budget
+        self.engine = engine # Used for logging, the cache works without one
+        self.entries = OrderedDict() # key: (asset, size)
+        self.size = 0
+        self.unpinned = 0 # The size of every asset that isn't pinned, which is the most that evicting could free
+        self.__pinned = set()
+        self.warned = False
+        # Counters for seeing how well the cache is doing
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        # Returns the asset or None if it's not in the cache
+        with self.lock:
+            try:
+                asset = self.entries[key][0]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key) # Now the most recently used
+            self.hits += 1
+            return asset
+
+    @property
+    def pinned(self):
+        return self.__pinned
+
+    @pinned.setter
+    def pinned(self, paths):
+        # Changing the pins changes how much could be thrown away, so that's added up again
+        with self.lock:
+            self.__pinned = set(paths)
+            self.unpinned = sum(size for key, (asset, size) in self.entries.items() if key[1] not in self.__pinned)
+            self.warned = False
+
+    def put(self, key, asset, size=None):
+        # Stores an asset, size can be given if it can't be worked out from the asset itself, like with fonts
+        if size is None:
+            size = self.estimate(asset)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (asset, size)
+            self.size += size
+            if key[1] not in self.__pinned:
+                self.unpinned += size
+            if self.budget and self.size > self.budget:
+                self.evict(key)
+
+    def remove(self, key):
+        # Takes an asset out, the lock must already be held
+        size = self.entries.pop(key)[1]
+        self.size -= size
+        if key[1] not in self.__pinned:
+            self.unpinned -= size
+
+    def evict(self, keep):
+        # Throws away the least recently used assets until we're back under budget
+        # keep is the key that was just added, it's never thrown away because it's about to be used
+        # Once only pinned assets and keep are left there's nothing to throw away, so it stops without looking through the rest
+        spare = self.unpinned - (0 if keep[1] in self.__pinned else self.entries[keep][1])
+        if spare > 0:
+            for key in list(self.entries):
+                if self.size <= self.budget or spare <= 0:
+                    break
+                if key == keep or key[1] in self.__pinned:
+                    continue
+                spare -= self.entries[key][1]
+                self.remove(key)
+                self.evictions += 1
+        if self.size-self.unpinned > self.budget and not self.warned:
+            self.warned = True
+            if self.engine:
+                self.engine.append_log("Pinned assets take up %d bytes, which is more than the cache budget of %d bytes, raise cache_budget", self.size-self.unpinned, self.budget, level=WARNING)
+
+    def clear(self, kind=None):
+        # Throws away every asset, or every asset of one kind, for example "image" when the texture quality changes
+        with self.lock:
+            for key in [x for x in self.entries if kind is None or x[0] == kind]:
+                self.remove(key)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries), "size": self.size, "pinned": self.size-self.unpinned, "budget": self.budget}
+
+    @staticmethod
+    def estimate(asset):
+        # Estimates how many bytes an asset takes up in memory
+        if isinstance(asset, pygame.Surface):
+            return asset.get_pitch()*asset.get_height()
+        if isinstance(asset, pygame.mixer.Sound):
+            # Sounds are stored uncompressed in the mixer's format
+            if mixer := pygame.mixer.get_init():
+                frequency, bits, channels = mixer
+                return int(asset.get_length()*frequency*channels*(abs(bits)//8))
+        return 0
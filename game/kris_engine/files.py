@@ -4,12 +4,37 @@ import os
 # Used for file operations
 from PIL import Image
 # Used for image scaling when building
-from io import BytesIO
+from io import BytesIO, RawIOBase
 # Used to return object in memory as buffer that acts like a file object
+import threading
+# Used to lock lazy lookups
+import mmap
+# Used to map KAP files into memory so assets can be sliced out without copying or sharing a file pointer
 import atexit
 # Close the KAP file on program termination
 from math import log2
 # Used for calculating number of options to check for RLE brute
+from concurrent.futures import ProcessPoolExecutor
+# Used to compress assets on several CPU cores at once when building
+import struct
+# Used to pack and unpack the fixed width tables in version 2 KAP files
+from zlib import crc32
+# Used to hash names for the version 2 hash table, it's the same every time unlike python's hash
+from kris_engine.log import DEBUG
+# Loading a file is logged at the debug level, as it happens a lot
+try:
+    import numpy as np
+    # Used to find runs and build RLE bytes in bulk instead of one pattern at a time
+except ImportError:
+    np = None
+    # numpy is optional, without it the pure python RLE functions are used, which produce the exact same bytes but slower
+
+# Layouts of the fixed width parts of a KAP file, see the KAP class for what each one means
+V2_HEADER = struct.Struct(">BIIII")
+QUALITY = struct.Struct(">IH")
+DIRECTORY = struct.Struct(">IHIB")
+LOCATION = struct.Struct(">BQQ")
+POINTER = struct.Struct(">QQ")
 
 class KAP:
 # Presenting the KAP file: Kris's Asset Package!
@@ -45,6 +70,31 @@ class KAP:
     # 64-bit integer, indicating the size of the file in bytes
 # Then the corresponding files will be dumped as RLE bytes into the files at their corresponding pointers
 
+# That's version 1. Version 2 has a fixed size directory so a KAP file can be opened without walking through every string.
+# After the magic byte there's an 8-bit integer 255, which is never a valid number of qualities in version 1, then an 8-bit version number, 2
+# Then:
+# 8-bit integer, number of qualities
+# 32-bit integer, number of entries in the directory
+# 32-bit integer, number of locations
+# 32-bit integer, number of slots in the hash table, always a power of 2
+# 32-bit integer, size of the string table in bytes
+# Then for each quality, in order of their ID starting at 1:
+    # 32-bit integer, position of the quality's name in the string table
+    # 16-bit integer, length of the name in bytes
+# Then for each entry in the directory:
+    # 32-bit integer, position of the file's name in the string table
+    # 16-bit integer, length of the name in bytes
+    # 32-bit integer, index of the file's first location
+    # 8-bit integer, number of texture qualities the file has, if 0 the file has exactly one location
+# Then for each location:
+    # 8-bit integer, texture quality ID, or 0 if the file doesn't have qualities
+    # 64-bit integer, indicating the pointer at which the file data starts in bytes
+    # 64-bit integer, indicating the size of the file in bytes
+# Then the hash table. Each slot is a 32-bit integer, the index of an entry in the directory plus 1, or 0 if the slot is empty
+# A name goes in the slot given by the CRC32 of its UTF-8 bytes modulo the number of slots, or the next empty slot after it
+# Then the string table, every name in UTF-8 one after another with nothing in between
+# Then the file data, the same as version 1
+
 # RLE bytes are bytes that are run length encoded.
 # RLE bytes start with a byte that is comprised of two 4-bit integers
 # The first represents counter_length, the second pattern_length
@@ -56,7 +106,7 @@ class KAP:
 # Then, the rest of the bytes are in the pattern of counter_length bytes, pattern_length bytes
 # To decode, repeat the pattern_length bytes the value of the counter_length bytes times
 
-    def __init__(self, path, engine=None):
+    def __init__(self, path, engine=None, lazy=False):
         # You'll see quite a few "if engine" throughout this module
         # It can be used with or without the main Engine class being initialised
         # If the engine is initialised, the module will post log messages      
@@ -66,90 +116,301 @@ class KAP:
         self.file_map, self.assets = {}, {}
         # Filemap tells us which KAP file an asset comes from
         # Assets contains information about where in the file the asset is and how big it is
+        # For KAP files opened lazily, assets only contains the files that have been looked up so far, use entry to look a file up
         self.open = []
         # A list of all the KAP files that are open, stripped to their base filename
-        self.load_kap(path, engine=engine)
+        self.lazy = []
+        # KAP files that were opened lazily and may still have files that aren't in assets, newest last
+        # Each item is a tuple of (version, memory map, what v2_tables returned or None for version 1)
+        self.lock = threading.Lock()
+        # Stops two threads resolving the same lazy entry at once
+        self.load_kap(path, engine=engine, lazy=lazy)
         atexit.register(self.__del__)
         # Will close file on program termination or if the KAP object is deleted with the del keyword
 
     def __del__(self):
-        for x in set(self.file_map.values()):
-            x.close()
+        for x in set(self.file_map.values()) | {y[1] for y in self.lazy}:
+            try: x.close()
+            except BufferError: pass
+            # An mmap can't be closed while a memoryview of it is still in use, it will be closed when that is garbage collected
         # Make sure KAP files are closed
 
-    def load_kap(self, path, engine=None):
+    # If lazy is True, only the header is checked when the file is opened
+    # Files in it are then looked up the first time they're needed, see entry
+    # Files that were already looked up or loaded from another KAP file keep coming from where they were found first
+    def load_kap(self, path, engine=None, lazy=False):
         if engine:
-            engine.append_log(f"Files module, loading KAP file {path}")
+            engine.append_log(f"Files module, loading KAP file {path}{' lazily' if lazy else ''}")
 
-        f = open(path, "rb")
-        # File stays open for reduced data access time
-        qualities={}
-        if not f.read(2) == b'\x07\xc9':
+        with open(path, "rb") as f:
+            # The file is mapped into memory for reduced data access time
+            # Slicing the map doesn't move a shared file pointer, so several threads can load assets at the same time
+            # The map stays valid after the file object is closed
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if not m[:2] == b'\x07\xc9':
             raise TypeError("Magic byte not found!")
         # Checks for magic byte at start of file to confirm file is of KAP type
-        for x in range(f.read(1)[0]): # 8-bit integer referring to number of textures
-            name = self.string_data(path, f) # Get texture name
-            qualities[f.read(1)] = name # Store with 8-bit texture ID
-        for x in range(int.from_bytes(f.read(4), "big")): # For number of textures in 32-bit integer
-            name = self.string_data(path, f) # Get file name
-            if (num_of_qualities := f.read(1)[0]) == 0: # Get number of qualities in 8-bit integer
-                # If the number of qualities is 0
-                self.assets[name] = (int.from_bytes(f.read(8), "big"), int.from_bytes(f.read(8), "big"))
+        if m[2] == 255: # Version 2 and above start with 255 where version 1 has the number of qualities
+            if m[3] != 2:
+                raise TypeError(f"Unsupported KAP version {m[3]}!")
+            if lazy:
+                self.lazy.append((2, m, self.v2_tables(m)))
+            else:
+                self.load_kap_v2(m)
+        elif lazy:
+            # Version 1 has no index, so the header is only read once something is looked up that hasn't been found yet
+            self.lazy.append((1, m, None))
+        else:
+            assets = self.load_kap_v1(m)
+            self.assets.update(assets)
+            self.file_map.update(dict.fromkeys(assets, m))
+            # Store in file map which KAP file each texture belongs to
+        self.open.append(os.path.basename(path))
+        # Add the filename to the list of open files if successful
+
+    def load_kap_v1(self, m):
+        # Returns a dictionary of every file in a version 1 KAP file, in the same form as self.assets
+        assets, qualities = {}, {}
+        pointer = 3
+        for x in range(m[2]): # 8-bit integer referring to number of textures
+            name, pointer = self.string_data(m, pointer) # Get texture name
+            qualities[m[pointer]] = name # Store with 8-bit texture ID
+            pointer += 1
+        num_of_textures = int.from_bytes(m[pointer:pointer+4], "big") # Number of textures in 32-bit integer
+        pointer += 4
+        for x in range(num_of_textures):
+            name, pointer = self.string_data(m, pointer) # Get file name
+            num_of_qualities = m[pointer] # Get number of qualities in 8-bit integer
+            pointer += 1
+            if num_of_qualities == 0: # If the number of qualities is 0
+                assets[name] = POINTER.unpack_from(m, pointer)
+                pointer += POINTER.size
                 # Store 64-bit integer position, 64-bit integer size
             else: # If the number of qualities is more than 0
-                self.assets[name] = {} # Then where our position and size tuple would be we store a dictionary
+                assets[name] = {} # Then where our position and size tuple would be we store a dictionary
                 for y in range(num_of_qualities):
-                    key = qualities[f.read(1)] # Using the 8-bit texture ID to get the string name of the quality
-                    self.assets[name][key] = (int.from_bytes(f.read(8), "big"), int.from_bytes(f.read(8), "big"))
-                    # Store # Store 64-bit integer position, 64-bit integer size with string name of quality as key
-            self.file_map[name] = f
-            # Store in file map which KAP file this texture belongs to
-        self.open.append(os.path.basename(path))
-        # Add the filename to the list of open files if successful
+                    quality, position, size = LOCATION.unpack_from(m, pointer)
+                    # Using the 8-bit texture ID to get the string name of the quality
+                    # Store 64-bit integer position, 64-bit integer size with string name of quality as key
+                    assets[name][qualities[quality]] = (position, size)
+                    pointer += LOCATION.size
+        return assets
+
+    def v2_tables(self, m):
+        # Works out where each table of a version 2 header starts from the fixed size part at the front
+        # Returns the quality names by ID, then the start of the directory, locations, hash table and string table, then the number of slots
+        num_of_qualities, num_of_entries, num_of_locations, slots, strings = V2_HEADER.unpack_from(m, 4)
+        quality_start = 4+V2_HEADER.size
+        directory_start = quality_start+QUALITY.size*num_of_qualities
+        location_start = directory_start+DIRECTORY.size*num_of_entries
+        hash_start = location_start+LOCATION.size*num_of_locations
+        string_start = hash_start+4*slots
+        qualities = {x: str(m[string_start+a:string_start+a+b], "utf-8") for x, (a, b) in enumerate(QUALITY.iter_unpack(m[quality_start:directory_start]), start=1)}
+        return qualities, directory_start, location_start, hash_start, string_start, slots
+
+    def load_kap_v2(self, m):
+        # The whole header is fixed width apart from the string table, so it's unpacked a table at a time
+        # The hash table isn't needed when every entry is read up front
+        qualities, directory_start, location_start, hash_start, string_start, slots = self.v2_tables(m)
+        locations = list(LOCATION.iter_unpack(m[location_start:hash_start]))
+        for a, b, first, num in DIRECTORY.iter_unpack(m[directory_start:location_start]):
+            name = str(m[string_start+a:string_start+a+b], "utf-8")
+            self.assets[name] = self.v2_entry(qualities, locations, first, num)
+            self.file_map[name] = m
+
+    def v2_entry(self, qualities, locations, first, num):
+        # Turns a file's locations into the position and size tuple, or dictionary of them by quality, that is stored in self.assets
+        if num == 0:
+            return locations[first][1:]
+        return {qualities[quality]: (position, size) for quality, position, size in locations[first:first+num]}
+
+    def find_v2(self, m, name, tables=None):
+        # Looks up a single file in a version 2 KAP file through the hash table, without reading the rest of the directory
+        # tables is what v2_tables returns, pass it in to avoid working it out again
+        # Returns the same thing that would be stored in self.assets, or None if the file isn't there
+        qualities, directory_start, location_start, hash_start, string_start, slots = tables or self.v2_tables(m)
+        encoded = name.encode("utf-8")
+        slot = crc32(encoded) & (slots-1)
+        while n := int.from_bytes(m[hash_start+4*slot:hash_start+4*slot+4], "big"):
+            a, b, first, num = DIRECTORY.unpack_from(m, directory_start+DIRECTORY.size*(n-1))
+            if m[string_start+a:string_start+a+b] == encoded:
+                locations = [LOCATION.unpack_from(m, location_start+LOCATION.size*x) for x in range(first, first+(num or 1))]
+                return self.v2_entry(qualities, locations, 0, num)
+            slot = (slot+1) & (slots-1)
+        return None
 
-    def string_data(self, path, file):
+    def string_data(self, m, pointer):
         # String data and other data are separated by 0 bytes
-        # This function will return the decoded string data of unknown length
-        pointer = file.tell()
-        for x in range(pointer, os.path.getsize(path)):
-            # For every byte between our current position in the file and the length of the file
-            # It would make sense to use a while loop that continues infinitely
-            # However if we never get a definitive 0 byte to signify the end of the script the function will error
-            # This way, if we reach the end of the file, we'll return None, signifying no string was found
-            if file.read(1) == bytes(1): # bytes(1) in python generates our 0 byte
-                # Reading one byte from the file also moves the pointer by one
-                # So, this loop reads through the file until it hits a 0 byte
-                file.seek(pointer)
-                # Then we return to our starting point
-                y = file.read(x-pointer)
-                # Read everything between our starting point and the 0 byte
-                file.seek(1, 1)
-                # Move past the 0 byte
-                return y.decode("utf-8")
-                # And decode the data so it's returned as a python string object!
+        # This function will return the decoded string data of unknown length, and the position just after its 0 byte
+        end = m.find(bytes(1), pointer) # bytes(1) in python generates our 0 byte
+        if end == -1:
+            # If we never get a definitive 0 byte to signify the end of the string, we'll return None, signifying no string was found
+            return None, len(m)
+        return str(m[pointer:end], "utf-8"), end+1
+
+    def entry(self, filename):
+        # Returns the position and size tuple, or dictionary of them by quality, of a file
+        # If it isn't in assets yet then the lazily opened KAP files are searched, newest first, and the result is kept in assets
+        # Raises KeyError if the file isn't in any open KAP file, just like looking it up in assets would
+        try:
+            return self.assets[filename]
+        except KeyError:
+            pass
+        with self.lock:
+            if filename in self.assets: # Another thread found it while we were waiting
+                return self.assets[filename]
+            for x in reversed(self.lazy):
+                version, m, tables = x
+                if version == 2:
+                    if (pointer := self.find_v2(m, filename, tables)) is not None:
+                        self.assets[filename] = pointer
+                        self.file_map[filename] = m
+                        return pointer
+                else:
+                    # Read the whole version 1 header, without overwriting anything that's already been found
+                    for name, pointer in self.load_kap_v1(m).items():
+                        if name not in self.assets:
+                            self.assets[name] = pointer
+                            self.file_map[name] = m
+                    self.lazy.remove(x)
+                    if filename in self.assets:
+                        return self.assets[filename]
+        raise KeyError(filename)
 
     def load(self, filename, quality=None, engine=None):
-        pointer = self.assets[filename]
+        pointer = self.entry(filename)
         # This shortens finding the filename in the assets dictionary to "pointer" because it's less to type
-        f = self.file_map[filename]
-        # This shortens finding the file object in the file map dictionary to "f" because it's less to type
+        m = self.file_map[filename]
+        # This shortens finding the memory map in the file map dictionary to "m" because it's less to type
 
         if isinstance(pointer, dict): # If the object in the assets dictionary is a dictionary then the file has qualities
             if not quality: # If the function call didn't specify a quality
                 quality = list(pointer.keys())[0] # Then we pick the first one in the dictionary, which using the build function will be the highest quality
             if engine:
-                engine.append_log(f"Files module, loading {filename}, quality {quality}")
+                engine.append_log("Files module, loading %s, quality %s", filename, quality, level=DEBUG)
             position, size = pointer[quality] # Unpack our position and size tuple for the quality that we want
         else: # If it's not a dictionary the file doesn't have qualities and assets will only have a tuple in it
             if engine:
-                engine.append_log(f"Files module, loading {filename}")
+                engine.append_log("Files module, loading %s", filename, level=DEBUG)
             position, size = pointer # Unpack position and size tuple
         
-        f.seek(position) # Move to the correct position in the file
-        x = f.read(size) # Read the number of bytes that make up the file
-        return BytesIO(rle_decode(x)) # Decode the RLE bytes and return them as a file-like object
+        x = memoryview(m)[position:position+size] # A view of the bytes that make up the file, nothing is copied yet
+        if x[0] == 0: # No compression, so we can hand out the mapped bytes directly
+            return MappedIO(x[1:])
+        return BytesIO(rle_decode(x)) # Decode the RLE bytes straight from the map and return them as a file-like object
+
+class MappedIO(RawIOBase):
+# A read-only file-like object over a memoryview
+# BytesIO would copy the whole asset on creation, this only copies what is actually read
+# getbuffer returns the memoryview itself, like it does on BytesIO
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self.view)-self.position)
+        if n <= 0:
+            return 0
+        b[:n] = self.view[self.position:self.position+n]
+        self.position += n
+        return n
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self.position = offset
+        elif whence == 1:
+            self.position += offset
+        else:
+            self.position = len(self.view)+offset
+        if self.position < 0:
+            raise ValueError("Negative seek position")
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def getbuffer(self):
+        return self.view
 
 def rle_encode(bytedata, counter_length, pattern_length):
+    # Uses the numpy implementation if numpy is installed, both produce byte identical output
+    if np is None:
+        return rle_encode_python(bytedata, counter_length, pattern_length)
+    return rle_encode_numpy(bytedata, counter_length, pattern_length)
+
+def rle_decode(bytedata):
+    if np is None:
+        return rle_decode_python(bytedata)
+    return rle_decode_numpy(bytedata)
+
+def rle_runs(data, pattern_length):
+    # Splits data into patterns of pattern_length bytes and finds where each run of identical patterns starts
+    # Returns the first pattern of every run as a 2D array, and how many times that pattern repeats
+    patterns = np.frombuffer(data, dtype=np.uint8).reshape(-1, pattern_length)
+    # Viewing each pattern as a single void item lets numpy compare whole patterns at once
+    keys = np.frombuffer(data, dtype=f"V{pattern_length}")
+    change = np.empty(len(patterns), dtype=bool)
+    change[0] = True
+    # A run starts wherever a pattern is different to the one before it
+    change[1:] = keys[1:] != keys[:-1]
+    starts = np.flatnonzero(change)
+    return patterns[starts], np.diff(starts, append=len(patterns))
+
+def rle_encode_numpy(bytedata, counter_length, pattern_length):
+    # The same algorithm as rle_encode_python, but the runs are found with array comparisons and the output is built in one go
+    if counter_length == 0 or pattern_length == 0:
+        return bytes(1) + bytedata
+    x = len(bytedata) % pattern_length
+    out = [
+        int((counter_length << 4) + pattern_length).to_bytes(1, "big"),
+        int(x).to_bytes(1, "big"),
+        bytes(bytedata[:x])
+        ]
+    if len(bytedata) == x:
+        # There's no data after the excess, the python implementation writes a counter of 0 here so we do the same
+        return out + [bytes(counter_length)]
+    patterns, counts = rle_runs(memoryview(bytedata)[x:], pattern_length)
+    if counter_length < 8:
+        max_counter_capacity = 2**(counter_length*8)-1
+        if counts.max() > max_counter_capacity:
+            # Runs that are too long for the counter are split into chunks of the maximum size followed by whatever is left over
+            chunks = (counts+max_counter_capacity-1)//max_counter_capacity
+            patterns = np.repeat(patterns, chunks, axis=0)
+            split = np.full(len(patterns), max_counter_capacity, dtype=np.int64)
+            split[np.cumsum(chunks)-1] = counts-(chunks-1)*max_counter_capacity
+            counts = split
+    counters = np.zeros((len(counts), counter_length), dtype=np.uint8)
+    # Counters are big endian, so the least significant 8 bytes go at the end and any bytes in front of those are always 0
+    n = min(counter_length, 8)
+    counters[:, counter_length-n:] = counts.astype(">u8").view(np.uint8).reshape(-1, 8)[:, 8-n:]
+    return out + [np.hstack((counters, patterns)).tobytes()]
+
+def rle_decode_numpy(bytedata):
+    counter_length = (bytedata[0] & 0b11110000) >> 4
+    pattern_length = bytedata[0] & 0b00001111
+    if counter_length == 0 or pattern_length == 0:
+        return bytes(bytedata[1:])
+    excess = bytes(bytedata[2:bytedata[1]+2])
+    data = np.frombuffer(bytedata, dtype=np.uint8, offset=bytedata[1]+2)
+    if len(data) % (counter_length+pattern_length):
+        # Not made of whole chunks, so let the python implementation deal with it the way it always has
+        return rle_decode_python(bytedata)
+    data = data.reshape(-1, counter_length+pattern_length)
+    # Pad the counters out to 8 bytes so they can be read as 64-bit integers
+    n = min(counter_length, 8)
+    counters = np.zeros((len(data), 8), dtype=np.uint8)
+    counters[:, 8-n:] = data[:, counter_length-n:counter_length]
+    # Repeat every pattern by its counter all at once
+    return excess + np.repeat(data[:, counter_length:], counters.view(">u8").ravel().astype(np.int64), axis=0).tobytes()
+
+def rle_encode_python(bytedata, counter_length, pattern_length):
     if counter_length == 0 or pattern_length == 0:
         return bytes(1) + bytedata
     # Sometimes, the best encoding is no encoding at all
@@ -216,12 +477,12 @@ def rle_encode(bytedata, counter_length, pattern_length):
     out[out_position] = counter.to_bytes(counter_length, "big") + dat
     return out
 
-def rle_decode(bytedata):
+def rle_decode_python(bytedata):
     # Two 4-bit integers contained within the first byte, so we used AND and bit shifting to get the two separate numbers
     counter_length = (bytedata[0] & 0b11110000) >> 4
     pattern_length = bytedata[0] & 0b00001111
     if counter_length == 0 or pattern_length == 0:
-        return bytedata[1:] # No compression, so no decompression either, just trim the 0 byte from the front!
+        return bytes(bytedata[1:]) # No compression, so no decompression either, just trim the 0 byte from the front!
     # Here we have a byte representing the number of bytes of excess, so we trim that excess from the front
     if bytedata[1] == 0:
         excess = b''
@@ -235,92 +496,202 @@ def rle_decode(bytedata):
     for x in iterator:
         dat = data[x:x+counter_length+pattern_length] # Get a chunk of data
         # Repeat the data for the number of times the pattern length specifies
-        out[out_position] = (int.from_bytes(dat[:counter_length], "big") * dat[counter_length:])
+        out[out_position] = (int.from_bytes(dat[:counter_length], "big") * bytes(dat[counter_length:]))
         out_position += 1
     # Convert our list of bytes into one bytes object and return it
     return b''.join(out)
 
-def rle_brute(bytedata): # Function for testing many compression settings and seeing which is the most effective
-    z = rle_encode(bytedata, 0, 0) # No compression at all is our baseline
-    out = ([z], len(z)) # Used to store the smallest output data and its size
-    best_pattern_length = 0 # Once we've tested every pattern length with counter length 1, we only need to test every counter length with that pattern length
-    a = int(log2(len(bytedata))/8) # Calculates how many pattern lengths need to be tested based on the size of the file being compressed
-    if len(bytedata) > 1_000_000: # Use a progress bar if the file being compressed is larger than 1MB
-        pbar = tqdm(desc="Compressing large file, please wait...", total=15+a-1)
-    for x in range(1, 16):
-        # Test all pattern lengths
-        y = rle_encode(bytedata, 1, x)
-        # Get size of output file by summing lengths, because function returns a list of bytes that will need to be combined
-        length = sum(len(z) for z in y)
-        if length < out[1]: # Store it if it's smaller than the smallest currently recorded
-            out = (y, length)
-            best_pattern_length = x
-        try: pbar.update()
-        except: pass
-    if best_pattern_length:
-        # Test all counter_lengths up to the one that would encapsulate the entire size of the file
-        for x in range(1, a+1 if a < 15 else 16): # (Unless you are somehow compressing a super big file and then it maxes out at 15)
-            y = rle_encode(bytedata, x, best_pattern_length)
-            length = sum(len(z) for z in y)
-            if length < out[1]:
-                out = (y, length)
-            try: pbar.update()
-            except: pass
-    else:
-        try: pbar.update(a-1)
-        except: pass
+def rle_run_lengths(data, pattern_length):
+    # Returns how long each run of identical patterns is, without building any output
+    if np is not None:
+        return rle_runs(data, pattern_length)[1]
+    lengths = []
+    dat, counter = data[0:pattern_length], 0
+    for a in range(0, len(data), pattern_length):
+        x = data[a:a+pattern_length]
+        if x == dat:
+            counter += 1
+        else:
+            lengths.append(counter)
+            counter = 1
+            dat = x
+    lengths.append(counter)
+    return lengths
+
+def rle_sizes(bytedata, counter_lengths, pattern_lengths, pbar=None):
+    # Works out exactly how many bytes rle_encode would output for every (counter_length, pattern_length) pair
+    # The data is only scanned once per pattern length, every counter length is then worked out from the run lengths
+    # Returns a dictionary of {(counter_length, pattern_length): size}
+    # pbar is an optional tqdm progress bar that is updated once per pattern length
+    sizes = {}
+    for pattern_length in pattern_lengths:
+        x = len(bytedata) % pattern_length # Excess bytes that are stored uncompressed at the front
+        if len(bytedata) == x:
+            # No data after the excess, rle_encode just writes a counter of 0
+            for counter_length in counter_lengths:
+                sizes[(counter_length, pattern_length)] = 2+x+counter_length
+            continue
+        lengths = rle_run_lengths(memoryview(bytedata)[x:] if np is not None else bytedata[x:], pattern_length)
+        for counter_length in counter_lengths:
+            if counter_length >= 8:
+                # A counter this big can hold any run length a file could possibly have, so each run is one chunk
+                chunks = len(lengths)
+            else:
+                # Runs longer than the counter can store are split into multiple chunks
+                max_counter_capacity = 2**(counter_length*8)-1
+                if np is not None:
+                    chunks = int(((lengths+max_counter_capacity-1)//max_counter_capacity).sum())
+                else:
+                    chunks = sum((y+max_counter_capacity-1)//max_counter_capacity for y in lengths)
+            # Encoding byte, excess length byte, the excess, then a counter and a pattern for every chunk
+            sizes[(counter_length, pattern_length)] = 2+x+chunks*(counter_length+pattern_length)
+        if pbar:
+            pbar.update()
+    return sizes
+
+def rle_brute(bytedata): # Function for finding the most effective compression settings
+    # The encoded size of every setting is estimated first, then only the smallest is actually encoded
+    best, size = (0, 0), len(bytedata)+1 # No compression at all is our baseline
+    if bytedata:
+        a = int(log2(len(bytedata))/8) # Calculates how many counter lengths are needed to encapsulate the size of the file being compressed
+        counter_lengths = range(1, min(max(a, 1), 15)+1) # (Unless you are somehow compressing a super big file and then it maxes out at 15)
+        # Use a progress bar if the file being compressed is larger than 1MB
+        pbar = tqdm(desc="Compressing large file, please wait...", total=15) if len(bytedata) > 1_000_000 else None
+        for x, y in rle_sizes(bytedata, counter_lengths, range(1, 16), pbar=pbar).items():
+            if y < size: # Store it if it's smaller than the smallest currently recorded
+                best, size = x, y
+        if pbar:
+            pbar.close()
+    out = rle_encode(bytedata, *best)
+    if isinstance(out, bytes):
+        return out
     # If the compressed data is less than 50MB then we combine it now and return it as a single bytes object
     # Otherwise, you would need several gigabytes in order to use .join, so you must iterate through the list of bytes in order to write it to a file
-    return b''.join(out[0]) if out[1] < 50_000_000 else out[0]
+    return b''.join(out) if size < 50_000_000 else out
+
+def build_asset(path, scale=None, compress=True):
+    # Reads one asset and returns it as RLE bytes, ready to be written into a KAP file
+    # If scale is given the file is an image, which is resized by that multiplier and saved as a PNG first
+    # This is a top level function so that it can be sent to worker processes by build
+    if scale is None:
+        with open(path, "rb") as y:
+            raw = y.read()
+    else:
+        image = Image.open(path)
+        out_raw = BytesIO()
+        out = image.resize((int(round(image.width*scale, 0)) or 1, int(round(image.height*scale, 0)) or 1)) if scale != 1 else image
+        out.save(out_raw, "png", optimize=True)
+        raw = out_raw.getvalue()
+    return rle_brute(raw) if compress else rle_encode(raw, 0, 0)
+
+def build_header_v1(f, qualities, with_quality, without_quality):
+    # Writes a version 1 header, returning where the placeholder for each file's location and size is in the same shape as KAP.assets
+    zero = bytes(1) # eight 0 bits
+    if len(qualities) == 0:
+        quality_ids = {"empty":int(1).to_bytes(1, "big")}
+    else:
+        # unique integer are generated by incrementing
+        quality_ids = {y:x.to_bytes(1, "big") for x,y in enumerate(qualities.keys(), start=1)}
+    pointers = {}
+    f.write(len(qualities).to_bytes(1, "big"))
+    for x in qualities: # For each quality write it's name and ID
+        f.write(x.encode("utf-8"))
+        f.write(zero)
+        f.write(quality_ids[x])
+    # 32-bit integer, how many textures in total (counting quality variants as the same texture)
+    f.write((len(without_quality)+len(with_quality)).to_bytes(4, "big"))
+    for x in without_quality: # Until we've compressed the data we don't know the location and sizes so we leave a blank placeholder
+        f.write(x.encode("utf-8"))
+        f.write(zero*2)
+        pointers[x] = f.tell()
+        f.write(zero*16)
+    for x in with_quality:
+        f.write(x.encode("utf-8"))
+        f.write(zero)
+        f.write(len(qualities).to_bytes(1, "big"))
+        pointers[x] = {}
+        for y in qualities:
+            f.write(quality_ids[y])
+            pointers[x][y] = f.tell()
+            f.write(zero*16)
+    return pointers
+
+def build_header_v2(f, qualities, with_quality, without_quality):
+    # Writes a version 2 header, returning where the placeholder for each file's location and size is in the same shape as KAP.assets
+    if with_quality and not qualities:
+        raise ValueError("Assets with quality need at least one quality!")
+    string_table = bytearray()
+    def add_string(x):
+        # Adds a name to the string table and returns its position and length
+        x = x.encode("utf-8")
+        string_table.extend(x)
+        return len(string_table)-len(x), len(x)
+    quality_table = [QUALITY.pack(*add_string(x)) for x in qualities]
+    directory, locations = [], []
+    for x in without_quality:
+        directory.append(DIRECTORY.pack(*add_string(x), len(locations), 0))
+        locations.append(LOCATION.pack(0, 0, 0))
+    for x in with_quality:
+        directory.append(DIRECTORY.pack(*add_string(x), len(locations), len(qualities)))
+        locations += [LOCATION.pack(y, 0, 0) for y in range(1, len(qualities)+1)]
+    # The hash table is at least twice as big as the directory so probing stays short
+    slots = 1
+    while slots < len(directory)*2:
+        slots *= 2
+    hash_table = [0]*slots
+    for n, x in enumerate(list(without_quality)+list(with_quality)):
+        slot = crc32(x.encode("utf-8")) & (slots-1)
+        while hash_table[slot]:
+            slot = (slot+1) & (slots-1)
+        hash_table[slot] = n+1
+    f.write(b'\xff\x02') # Version 2
+    f.write(V2_HEADER.pack(len(qualities), len(directory), len(locations), slots, len(string_table)))
+    f.write(b''.join(quality_table))
+    f.write(b''.join(directory))
+    # The placeholder is everything in a location after the quality ID
+    start = f.tell()+1
+    f.write(b''.join(locations))
+    f.write(struct.pack(f">{slots}I", *hash_table))
+    f.write(string_table)
+    pointers = {x: start+LOCATION.size*n for n, x in enumerate(without_quality)}
+    n = len(without_quality)
+    for x in with_quality:
+        pointers[x] = {}
+        for y in qualities:
+            pointers[x][y] = start+LOCATION.size*n
+            n += 1
+    return pointers
 
 # Function used for the creation of KAP files
 # qualities is a dictionary: {quality name: float scale} where the float is the multiplier with which images should be scaled
 # with_quality is a list of filenames
 # without_quality is a list of filenames
 # out_path is a string specifying the output file path
-def build(qualities, with_quality, without_quality, out_path, compress=True):
+# workers is how many processes compress assets at the same time, None uses every CPU core
+# If workers isn't 1, the script calling build needs an if __name__ == "__main__" guard so the worker processes don't run it again
+# version is the KAP version to write, 2 unless you need the file to be read by an older copy of the engine
+def build(qualities, with_quality, without_quality, out_path, compress=True, workers=1, version=2):
     print("Building KAP file...")
-    zero = bytes(1) # eight 0 bits
-    if len(qualities) > 255:
+    if len(qualities) > 254:
+        # 255 qualities would look like the start of a version 2 header
         raise OverflowError("Too many qualities! Why do you need that many?")
-    elif len(qualities) == 0:
-        quality_ids = {"empty":int(1).to_bytes(1, "big")}
-    else:
-        # unique integer are generated by incrementing
-        quality_ids = {y:x.to_bytes(1, "big") for x,y in enumerate(qualities.keys(), start=1)}
-    pointers = {}
+    if version not in (1, 2):
+        raise ValueError(f"Can't build KAP version {version}!")
     with open(out_path, "wb") as f:
         f.write(b'\x07\xc9') # Magic byte 1993
-        f.write(len(qualities).to_bytes(1, "big"))
-        for x in qualities: # For each quality write it's name and ID
-            f.write(x.encode("utf-8"))
-            f.write(zero)
-            f.write(quality_ids[x])
-        # 32-bit integer, how many textures in total (counting quality variants as the same texture)
-        f.write((len(without_quality)+len(with_quality)).to_bytes(4, "big"))
-        for x in without_quality: # Until we've compressed the data we don't know the location and sizes so we leave a blank placeholder
-            f.write(x.encode("utf-8"))
-            f.write(zero*2)
-            pointers[x] = f.tell()
-            f.write(zero*16)
-        for x in with_quality:
-            f.write(x.encode("utf-8"))
-            f.write(zero)
-            f.write(len(qualities).to_bytes(1, "big"))
-            pointers[x] = {}
-            for y in qualities:
-                f.write(quality_ids[y])
-                pointers[x][y] = f.tell()
-                f.write(zero*16)
-        for x in tqdm(iterable=without_quality, desc="Dumping raw data for assets without quality"):
-            with open(x, "rb") as y:
-                raw = y.read()
-                raw = rle_brute(raw) if compress else rle_encode(raw, 0, 0)
+        pointers = (build_header_v1 if version == 1 else build_header_v2)(f, qualities, with_quality, without_quality)
+        # Every asset, and every quality of every image, is a separate job
+        # The jobs and the header placeholders they fill in are kept in the same order so the output is the same however the jobs are run
+        paths = list(without_quality) + [x for x in with_quality for y in qualities]
+        scales = [None]*len(without_quality) + [qualities[y] for x in with_quality for y in qualities]
+        placeholders = [pointers[x] for x in without_quality] + [pointers[x][y] for x in with_quality for y in qualities]
+        def dump(results):
+            for placeholder, raw in zip(placeholders, tqdm(iterable=results, total=len(paths), desc="Dumping compressed data for assets")):
                 # Write the compressed data to the file, then go back to the file's location in the header and write it's location and size
                 pointer = f.tell()
-                f.seek(pointers[x])
+                f.seek(placeholder)
                 f.write(pointer.to_bytes(8, "big"))
-                f.write(len(raw).to_bytes(8, "big"))
+                f.write((sum(len(z) for z in raw) if type(raw) == list else len(raw)).to_bytes(8, "big"))
                 f.seek(0, 2)
                 # If it's a list of bytes that is too big to combine we iterate through that list, otherwise we write the bytes object
                 if type(raw) == list:
@@ -328,22 +699,12 @@ def build(qualities, with_quality, without_quality, out_path, compress=True):
                         f.write(z)
                 else:
                     f.write(raw)
-        for x in tqdm(iterable=with_quality, desc="Dumping raw data for assets with quality"):
-            raw = Image.open(x)
-            for y in qualities:
-                # The same as before but now we are resizing the images to different texture qualities and storing information about each quality
-                out_raw = BytesIO()
-                out = raw.resize((int(round(raw.width*qualities[y], 0)) or 1, int(round(raw.height*qualities[y], 0)) or 1)) if qualities[y] != 1 else raw
-                out.save(out_raw, "png", optimize=True)
-                out_raw = rle_brute(out_raw.getvalue()) if compress else rle_encode(out_raw.getvalue(), 0, 0)
-                pointer = f.tell()
-                f.seek(pointers[x][y])
-                f.write(pointer.to_bytes(8, "big"))
-                f.write(len(out_raw).to_bytes(8, "big"))
-                f.seek(0, 2)
-                if type(out_raw) == list:
-                    for z in out_raw:
-                        f.write(z)
-                else:
-                    f.write(out_raw)
+        if workers == 1:
+            dump(map(build_asset, paths, scales, [compress]*len(paths)))
+        else:
+            # Worker processes resize, save and compress assets while this process writes whatever is finished next
+            # executor.map hands results back in the order the jobs were given, not the order they finished in
+            # The with block shuts the workers down even if writing fails part way through
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                dump(executor.map(build_asset, paths, scales, [compress]*len(paths)))
     print("Done!")
\ No newline at end of file
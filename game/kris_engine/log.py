@@ -0,0 +1,103 @@
+import sys
+# Writing to the console
+import os
+# Renaming old log files
+import time
+import threading
+from queue import SimpleQueue, Empty
+# A queue that any thread can add to without waiting
+from kris_engine.colour import Colour
+
+# Log levels, messages below the log's level are thrown away before anything is formatted
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+# The name written in front of each message
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+class Log:
+# Takes log messages from any thread and writes them to the console and the log file on its own thread
+# Adding a message only puts a tuple on a queue, all the formatting and writing is done by the logging thread in batches
+# threads is the engine's threads dictionary, thread ID: {"colour": Colour, "name": str}, used to colour messages by thread
+# The log file is written to as the program runs, once it gets bigger than max_size it's renamed to path + ".1" (replacing any older one) and a new one is started
+
+    def __init__(self, path, max_size, threads, level=INFO, interval=0.5):
+        self.path = path
+        self.max_size = max_size
+        self.threads = threads
+        self.level = level
+        self.interval = interval # Number of seconds between writing batches of messages
+        self.start_time = time.perf_counter() # Used for calculating how long the program has been running
+        self.queue = SimpleQueue() # (time, thread ID, level, message, args) tuples, None tells the logging thread to stop
+        self.stopping = threading.Event()
+        self.file = None
+        # Daemon so it never keeps the program open, close is called on exit to write whatever is left
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def put(self, message, args, level=INFO):
+        self.queue.put((time.perf_counter(), threading.get_ident(), level, message, args))
+
+    def loop(self):
+        # Assign a colour to the logging thread
+        self.threads[threading.get_ident()] = {"colour": Colour(0x10ebe1), "name": "Logging"}
+        self.open()
+        self.write([Colour(0xff00ff)+"Welcome to Kris's Engine!\n"], ["Welcome to Kris's Engine!\n"])
+        while True:
+            # Wait for a message, then take everything else that's been added since so it's all written at once
+            records = [self.queue.get()]
+            while True:
+                try: records.append(self.queue.get_nowait())
+                except Empty: break
+            console, full = [], []
+            for x in records:
+                if x is not None:
+                    self.format(x, console, full)
+            if None in records: # A blank line between each time the program was run
+                full.append("\n")
+            self.write(console, full)
+            if None in records:
+                self.file.close()
+                return
+            self.stopping.wait(self.interval) # Wait. Note this only pauses this logging thread, not other threads
+
+    def format(self, record, console, full):
+        t, thread, level, message, args = record
+        thread = self.threads.get(thread, {"colour": Colour(0xffffff), "name": "Unknown"})
+        if args: # Messages with args are formatted like the logging module, message % args, but only now that we know it's being written
+            try: message = message % args
+            except (TypeError, ValueError): message = f"{message} {args}"
+        name_and_time = f"{thread['name']} thread at {t-self.start_time}"
+        level = LEVEL_NAMES.get(level, f"LEVEL {level}")
+        console.append(f"{thread['colour']}[{name_and_time}] {Colour(0xffffff)}{level}: {message}\n")
+        full.append(f"[{name_and_time}] {level}: {message}\n")
+
+    def write(self, console, full):
+        sys.stdout.write("".join(console)) # Flush to console, faster than print!
+        # The file is opened in binary so that tell and the size of what's being written are both in bytes, even with characters that take more than one byte
+        full = "".join(full).encode()
+        # Start a new file first if this would take the log file over its maximum size
+        if self.file.tell() and self.file.tell()+len(full) > self.max_size:
+            self.rotate()
+        self.file.write(full)
+        self.file.flush()
+
+    def open(self):
+        # Carry on from the end of the last log file, write starts a new one if it's too big
+        try:
+            self.file = open(self.path, "ab")
+        except FileNotFoundError: # If the folder doesn't exist then there's nowhere to log to
+            self.file = open(os.devnull, "wb")
+
+    def rotate(self):
+        self.file.close()
+        os.replace(self.path, self.path+".1")
+        self.file = open(self.path, "wb")
+
+    def close(self):
+        # Writes everything that's left and waits for the logging thread to finish, called when the program exits
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.stopping.set()
+            self.thread.join()
@@ -1,7 +1,9 @@
 from kris_engine import Scene, Entity
+from kris_engine.log import WARNING, ERROR
 from kris_engine.colour import Colour
 import threading
 import pygame
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 class ProgressBar(Entity):
     # func is the thing that's going to be called on each item during loading, this is get_asset by default
@@ -15,6 +17,10 @@ class ProgressBar(Entity):
         self.total = total
         self.prog_incr = prog_incr
         self.progress = 0
+        # Worker threads all add to progress at once, so it's protected by a lock
+        self.lock = threading.Lock()
+        # Items that raised an exception while loading, as (item, exception) tuples
+        self.failed = []
         self.engine.pbar_out = None
         # Start the progress bar thread
         self.thread = threading.Thread(target=self.monitor_progress, args=(func, iterable, self.engine, exit_scene, *args), kwargs=kwargs)
@@ -36,19 +42,52 @@ class ProgressBar(Entity):
     def monitor_progress(self, func, iterable, engine, exit_scene, *args, **kwargs):
         # Give the progress bar thread a text colour
         self.engine.threads[threading.get_ident()] = {"colour": Colour(0x4C19FF), "name": "Progress Bar"}
-        engine.pbar_out = []
-        # For each item in iterable, call function on it, update the progress variable and check if the engine is still running
-        # This check is done so that if the user quits during a progress bar, then loading quits also
-        for x in iterable:
-            try: engine.pbar_out.append(func(x))
-            except: pass
-            try: self.progress += self.prog_incr(x)
-            except: pass
-            if not self.engine.running:
-                return
+        iterable = list(iterable)
+        engine.pbar_out = [None]*len(iterable)
+        # func is called on the items across engine.load_threads worker threads, so reading from KAP files, RLE decoding and PNG/OGG decoding overlap
+        # The biggest items are started first, so that one big file isn't left loading on its own at the end while the other workers have nothing to do
+        order = sorted(range(len(iterable)), key=lambda i: self.weight(iterable[i]), reverse=True)
+        with ThreadPoolExecutor(max_workers=engine.load_threads, thread_name_prefix="Loader") as pool:
+            futures = {pool.submit(self.work, func, iterable[i]): i for i in order}
+            pending = set(futures)
+            # Check if the engine is still running every time something finishes, or at least every tenth of a second
+            # This check is done so that if the user quits during a progress bar, then loading quits also
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for x in done:
+                    # pbar_out stays in the same order as iterable no matter what order things finish in
+                    engine.pbar_out[futures[x]] = x.result()
+                if not self.engine.running:
+                    for x in pending:
+                        x.cancel()
+                    return
+        # Failed items used to be silently skipped, now they're reported so that a missing or broken asset is noticed
+        if self.failed:
+            engine.append_log(f"Warning! {len(self.failed)} of {len(iterable)} items failed to load: {', '.join(str(x) for x, e in self.failed)}", level=WARNING)
         # Load the exit scene once loading is complete, but this time without using the progress bar again
         engine.load_scene(exit_scene, *args, pbar=False, **kwargs)
 
+    def weight(self, x):
+        # How much the progress bar increases by for an item, 0 if prog_incr can't measure it
+        try: return self.prog_incr(x)
+        except: return 0
+
+    def work(self, func, x):
+        # Runs on a worker thread, calls func on one item and then moves the progress bar along
+        if threading.get_ident() not in self.engine.threads:
+            self.engine.threads[threading.get_ident()] = {"colour": Colour(0x7a5cff), "name": "Loader"}
+        if not self.engine.running:
+            return None
+        try: out = func(x)
+        except Exception as e:
+            self.engine.append_log(f"Error! Failed to load {x}: {type(e).__name__}: {e}", level=ERROR)
+            with self.lock:
+                self.failed.append((x, e))
+            out = None
+        with self.lock:
+            self.progress += self.weight(x)
+        return out
+
 class Pbar(Scene):
     update_rate = 1
     # A low render rate make the progress bar appear choppy but reduces load times
@@ -0,0 +1,120 @@
+import pygame
+# Used to draw the overlay
+import time
+import threading
+import json
+import csv
+# Formats a trace can be saved in
+from collections import deque
+
+class Profiler:
+# Records how long each part of each frame takes, so you can see where the frame time goes
+# Times are added to the frame that's currently being rendered with record, and end_frame moves on to the next frame
+# Each section's total per frame is kept for the last window frames to work out percentiles, and the last trace_length frames are kept to be saved with export
+# Section names are things like "update Grid", "render Score", "background" and "display.update", and "cache misses" is a count rather than a time
+
+    def __init__(self, engine, window=600, trace_length=10000):
+        self.engine = engine
+        self.window = window
+        self.sections = {} # name: deque of per frame totals
+        self.trace = deque(maxlen=trace_length) # One dictionary per frame
+        self.frame = {} # Totals for the frame currently being rendered
+        self.frame_start = time.perf_counter()
+        self.misses = 0 # Cache misses so far, to work out how many happened in each frame
+        self.overlay = False # Toggled with F3
+        self.lines, self.lines_time = [], 0 # The overlay's text, only worked out a few times a second as sorting every section every frame would be slow
+        self.lock = threading.Lock() # Updates are recorded from the update thread while frames are rendered on the render thread
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.frame[name] = self.frame.get(name, 0) + seconds
+
+    def lap(self, name, start):
+        # Records the time since start and returns the current time, so the next section can start from it
+        t = time.perf_counter()
+        self.record(name, t-start)
+        return t
+
+    def update(self, entities):
+        # Updates every entity like Engine.tick does, timing each one
+        for e in entities:
+            start = time.perf_counter()
+            e.update()
+            self.record(f"update {type(e).__name__}", time.perf_counter()-start)
+
+    def end_frame(self):
+        # Called by the render thread after each frame is displayed
+        t = time.perf_counter()
+        with self.lock:
+            frame, self.frame = self.frame, {}
+        frame["frame"] = t-self.frame_start
+        self.frame_start = t
+        misses = self.engine.cache.misses
+        frame["cache misses"] = misses-self.misses
+        self.misses = misses
+        for name, x in frame.items():
+            if name not in self.sections:
+                self.sections[name] = deque(maxlen=self.window)
+            self.sections[name].append(x)
+        frame["number"] = self.engine.render_counter
+        self.trace.append(frame)
+
+    def percentiles(self, name, percentiles=(50, 95, 99)):
+        # Percentiles of a section's per frame totals over the last window frames, nearest rank
+        x = sorted(self.sections.get(name, ()))
+        if not x:
+            return tuple(0 for p in percentiles)
+        return tuple(x[min(len(x)-1, int(len(x)*p/100))] for p in percentiles)
+
+    def stats(self):
+        # Every section's mean, 50th, 95th and 99th percentiles and maximum, times are in milliseconds
+        out = {}
+        for name in list(self.sections):
+            scale = 1 if name == "cache misses" else 1000
+            x = list(self.sections[name])
+            p50, p95, p99 = self.percentiles(name)
+            out[name] = {"frames": len(x), "mean": sum(x)/len(x)*scale, "p50": p50*scale, "p95": p95*scale, "p99": p99*scale, "max": max(x)*scale}
+        return out
+
+    def export(self, path):
+        # Saves the trace, one row per section per frame for CSV, or a list with a dictionary for each frame for JSON
+        # Times are in seconds
+        frames = list(self.trace)
+        if path[-5:] == ".json":
+            with open(path, "w") as f:
+                json.dump({"stats": self.stats(), "frames": frames}, f)
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(("frame", "section", "value"))
+                for frame in frames:
+                    for name, x in frame.items():
+                        if name != "number":
+                            writer.writerow((frame["number"], name, x))
+        self.engine.append_log(f"Profiler trace of {len(frames)} frames saved to {path}")
+
+    @property
+    def rect(self):
+        # Where the overlay is drawn, top left of the window
+        return pygame.Rect(0, 0, self.engine.width*0.45, self.engine.height*0.5)
+
+    def draw(self):
+        # The overlay, each section's percentiles over the last window frames, slowest first
+        rect = self.rect
+        font = self.engine.get_asset("ComicMono.ttf", font=max(int(rect.h/24), 8))
+        background = pygame.Surface(rect.size, pygame.SRCALPHA)
+        background.fill((0, 0, 0, 192))
+        self.engine.screen.blit(background, rect)
+        if time.perf_counter()-self.lines_time > 0.25:
+            stats = self.stats()
+            self.lines = ["section: p50 / p95 / p99 ms"]
+            for name in sorted(stats, key=lambda x: -stats[x]["p95"] if x != "cache misses" else 0):
+                x = stats[name]
+                self.lines.append(f"{name}: {x['p50']:.2f} / {x['p95']:.2f} / {x['p99']:.2f}" if name != "cache misses" else f"{name}: {x['mean']:.2f} per frame")
+            self.lines_time = time.perf_counter()
+        y = rect.y
+        for line in self.lines:
+            if y+font.get_linesize() > rect.bottom:
+                break
+            self.engine.screen.blit(font.render(line, True, 0xffffffff), (rect.x+4, y))
+            y += font.get_linesize()
@@ -0,0 +1,28 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # Doesn't need a visible window to measure blitting
+import pygame
+from time import perf_counter
+
+# Times how many blits per second you get from images straight out of pygame.image.load compared to images converted to the display's pixel format
+# Uses the images in this folder, at a few different scales
+pygame.init()
+screen = pygame.display.set_mode((1280, 720))
+
+def timed(image):
+    # Blits for a second and counts how many it managed
+    count = 0
+    start = perf_counter()
+    while perf_counter()-start < 1:
+        for x in range(100):
+            screen.blit(image, (x, x))
+        count += 100
+    return count/(perf_counter()-start)
+
+for name in [x for x in os.listdir() if x[-3:] == "png"]:
+    raw = pygame.image.load(name)
+    for height in (48, 144, 720):
+        image = pygame.transform.scale(raw, (int(height/raw.get_height()*raw.get_width()), height))
+        converted = image.convert_alpha() if image.get_flags() & pygame.SRCALPHA else image.convert()
+        before, after = timed(image), timed(converted)
+        print(f"{name} at height {height}: {before:.0f} -> {after:.0f} blits per second ({after/before:.1f}x)")
+pygame.quit()
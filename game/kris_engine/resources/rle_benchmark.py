@@ -0,0 +1,34 @@
+import sys
+sys.path.append("../..")
+import kris_engine.files
+
+from os import listdir
+from os.path import isfile
+from time import perf_counter
+from random import randbytes, seed
+
+# Times the numpy and pure python RLE functions on every file in this folder plus some generated data, so you can see if it was worth it
+# That they give the same output is checked by tests/test_rle.py
+if kris_engine.files.np is None:
+    raise ImportError("numpy isn't installed, so there's nothing to time against")
+
+seed(1993)
+samples = {x: open(x, "rb").read() for x in listdir() if isfile(x) and x[-2:] != "py"}
+samples["zeros"] = bytes(5_000_000)
+samples["random"] = randbytes(1_000_000)
+samples["stripes"] = (bytes(300) + b'\xff'*300)*5000
+
+def timed(func, *args):
+    start = perf_counter()
+    out = func(*args)
+    return out, perf_counter()-start
+
+for name, data in samples.items():
+    for counter_length, pattern_length in ((1, 1), (2, 1), (1, 3), (3, 4)):
+        slow_time = timed(kris_engine.files.rle_encode_python, data, counter_length, pattern_length)[1]
+        fast, fast_time = timed(kris_engine.files.rle_encode_numpy, data, counter_length, pattern_length)
+        fast = b''.join(fast)
+        slow_decode_time = timed(kris_engine.files.rle_decode_python, fast)[1]
+        fast_decode_time = timed(kris_engine.files.rle_decode_numpy, fast)[1]
+        mb = len(data)/1_000_000
+        print(f"{name} ({counter_length}, {pattern_length}): encode {mb/slow_time:.1f}MB/s -> {mb/fast_time:.1f}MB/s, decode {mb/slow_decode_time:.1f}MB/s -> {mb/fast_decode_time:.1f}MB/s")
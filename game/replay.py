@@ -0,0 +1,71 @@
+import struct
+# Used to pack and unpack the header
+from kris_engine import Engine
+from kris_engine.files import rle_brute, rle_decode
+# Recordings are mostly the same byte over and over, so they're stored with the same RLE compression as KAP files
+from kris_engine.log import WARNING
+
+class Replay:
+# A recorded game, the grid's seed and the InputHandler's state and rotation for every update, see InputHandler.pack
+# Playing it back in a headless engine gives exactly the same game, so the score at the end should always be the same as when it was recorded
+# This is for checking that changes to the grid haven't changed how the game plays, without having to play it
+# A replay file is the header, then the RLE encoded recording
+
+    # Magic bytes, version, seed, score at the end
+    header = struct.Struct(">4sBIQ")
+    version = 1
+
+    def __init__(self, seed, actions, score):
+        self.seed = seed
+        self.actions = bytes(actions)
+        self.score = score
+
+    @classmethod
+    def record(cls, grid):
+        # The replay of a grid's game so far
+        return cls(grid.seed, grid.input_handler.recording, grid.score.score)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.header.pack(b"KRPL", self.version, self.seed, self.score))
+            f.write(rle_brute(self.actions))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, seed, score = cls.header.unpack_from(data)
+        if magic != b"KRPL":
+            raise ValueError(f"{path} is not a replay file")
+        if version != cls.version:
+            raise ValueError(f"{path} is a version {version} replay, only version {cls.version} can be played")
+        return cls(seed, rle_decode(data[cls.header.size:]), score)
+
+    def run(self, scene, **kwargs):
+        # Plays the replay back as fast as possible in a headless engine and returns the score at the end
+        # scene is the scene it was recorded in, which has to pass seed and replay on to its grid and input handler like ExerciseClassic does, and keep its grid as scene.grid
+        # kwargs are passed to the engine
+        replay = self
+        class ReplayScene(scene):
+            def __init__(self, engine):
+                super().__init__(engine, seed=replay.seed, replay=replay.actions)
+        kwargs.setdefault("log_level", WARNING)
+        engine = Engine(scene=ReplayScene, headless=True, **kwargs)
+        engine.run(len(self.actions))
+        score = engine.scene.grid.score.score
+        engine.quit()
+        return score
+
+    def check(self, scene, **kwargs):
+        # True if playing the replay back gets the score it was recorded with
+        return self.run(scene, **kwargs) == self.score
+
+if __name__ == "__main__":
+    # python replay.py [path], plays a replay back and checks its score
+    # Games are only saved if the scene is given save_replay, like Engine(scene=ExerciseClassic, save_replay="replay.krp")
+    import sys
+    from exercise import ExerciseClassic
+    replay = Replay.load(sys.argv[1] if len(sys.argv) > 1 else "replay.krp")
+    score = replay.run(ExerciseClassic)
+    print(f"{len(replay.actions)} updates, recorded score {replay.score}, replayed score {score}, {'passed' if score == replay.score else 'FAILED'}")
+    sys.exit(score != replay.score)
@@ -4,11 +4,13 @@ import kris_engine.files
 
 from os import listdir
 
-kris_engine.files.build({
-    "ultra_high": 1,
-    "high": 0.25,
-    "medium": 0.0625,
-    "low": 0.015625,
-    "ultra_low": 0.00390625,
-    "potato": 0
-}, [x for x in listdir() if x[-3:] == "png"], [x for x in listdir() if x[-3:] == "ogg"], "..\\base.kap")
\ No newline at end of file
+# The guard stops the worker processes that build uses from running this script again
+if __name__ == "__main__":
+    kris_engine.files.build({
+        "ultra_high": 1,
+        "high": 0.25,
+        "medium": 0.0625,
+        "low": 0.015625,
+        "ultra_low": 0.00390625,
+        "potato": 0
+    }, [x for x in listdir() if x[-3:] == "png"], [x for x in listdir() if x[-3:] == "ogg"], "..\\base.kap", workers=None)
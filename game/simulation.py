@@ -0,0 +1,155 @@
+import numpy as np
+# Every board is a layer of one array, so each rule is applied to all of them at once
+from board import chain_power_lookup, colour_bonus_lookup, group_bonus_lookup
+
+# The scoring rules from board.py as arrays, so a bonus can be looked up for every board at once
+CHAIN_POWER = np.array([0]+[chain_power_lookup(x) for x in range(1, 100)], dtype=np.int64)
+# The colour bonus is looked up by the number of groups popped at once, 60 is more than a board twice the height of the grid can hold
+COLOUR_BONUS = np.array([0]+[colour_bonus_lookup(x) for x in range(1, 61)], dtype=np.int64)
+GROUP_BONUS = np.array([group_bonus_lookup(x) for x in range(1000)], dtype=np.int64)
+
+class Simulation:
+# The rules of Grid without any of the animation, input or drawing, for playing lots of games quickly
+# cells[board, row, column] is the colour of a bean (1 to 5) or 0 if it's empty, row 0 is the bottom like Grid.values
+# A pair of beans is placed straight into its column, then gravity and popping are repeated until nothing pops, which is a whole chain in one call instead of hundreds of updates
+# The grid can go height rows high, past that and the board is dead, which is as well as the death cell in the third column of the top row that Grid uses
+
+    def __init__(self, boards, rows=12, columns=6, height=None):
+        self.rows, self.columns = rows, columns
+        self.height = height or rows*2
+        self.cells = np.zeros((boards, self.height, columns), dtype=np.uint8)
+        self.score = np.zeros(boards, dtype=np.int64)
+        self.dead = np.zeros(boards, dtype=bool)
+        self.chains = np.zeros(boards, dtype=np.int64) # Chain power of the last chain on each board
+
+    @classmethod
+    def from_values(cls, values, rows=12, columns=6, height=None):
+        # Makes a simulation from a list of Grid.values lists (or lists of colours), one board each
+        out = cls(len(values), rows, columns, height)
+        for n, board in enumerate(values):
+            for position, bean in enumerate(board):
+                if bean:
+                    if position >= out.height*columns:
+                        out.dead[n] = True
+                        break
+                    # Beans or colours both work
+                    out.cells[n, position // columns, position % columns] = bean if type(bean) == int else bean.colour
+        out.gravity()
+        return out
+
+    def __len__(self):
+        return len(self.cells)
+
+    def copy(self):
+        return self.select(np.arange(len(self)))
+
+    def select(self, boards):
+        # A new simulation of some of the boards, boards can be an index array or a boolean mask, and can repeat boards
+        out = Simulation(0, self.rows, self.columns, self.height)
+        out.cells, out.score, out.dead, out.chains = self.cells[boards], self.score[boards], self.dead[boards], self.chains[boards]
+        return out
+
+    def values(self, board):
+        # A board as a 1D list of colours like Grid.values, with 0 for empty cells
+        return self.cells[board].ravel().tolist()
+
+    def gravity(self, boards=slice(None)):
+        # Sorting each column by whether a cell is empty moves every bean to the bottom, and a stable sort keeps them in the same order
+        cells = self.cells[boards]
+        order = np.argsort(cells == 0, axis=1, kind="stable")
+        self.cells[boards] = np.take_along_axis(cells, order, axis=1)
+
+    @staticmethod
+    def groups(cells):
+        # Labels every bean with the lowest cell number in its colour group, for an array of boards
+        # Each pass, every bean takes the lowest label of itself and its same coloured neighbours, then jumps to its label's label, until nothing changes
+        occupied = cells > 0
+        labels = np.arange(cells.size, dtype=np.int32).reshape(cells.shape)
+        # Pairs of (slice of cells, slice of the neighbours in one direction)
+        pairs = (
+            ((slice(None), slice(1, None)), (slice(None), slice(None, -1))), # Below
+            ((slice(None), slice(None, -1)), (slice(None), slice(1, None))), # Above
+            ((slice(None), slice(None), slice(1, None)), (slice(None), slice(None), slice(None, -1))), # Left
+            ((slice(None), slice(None), slice(None, -1)), (slice(None), slice(None), slice(1, None))) # Right
+        )
+        same = [occupied[a] & (cells[a] == cells[b]) for a, b in pairs]
+        while True:
+            new = labels.copy()
+            for (a, b), x in zip(pairs, same):
+                np.minimum(new[a], labels[b], out=new[a], where=x)
+            new = new.ravel()[new]
+            if np.array_equal(new, labels):
+                return labels, occupied
+            labels = new
+
+    def pop(self, boards):
+        # Pops every group of 4 or more on some boards at once, boards is an index array
+        # Returns the number of beans popped, the group bonus and the number of groups popped on each of those boards
+        cells = self.cells[boards]
+        # Only the rows up to the highest bean on any of the boards need to be looked at
+        rows = np.flatnonzero((cells > 0).any(axis=(0, 2)))
+        top = rows[-1]+1 if len(rows) else 1
+        cells = cells[:, :top]
+        labels, occupied = self.groups(cells)
+        sizes = np.bincount(labels[occupied], minlength=cells.size)
+        size = np.where(occupied, sizes[labels], 0)
+        popping = size >= 4
+        # The bean with the lowest cell number in a group is the one its group is labelled with, so each group is counted once
+        roots = popping & (labels == np.arange(cells.size).reshape(cells.shape))
+        group_bonus = np.where(roots, GROUP_BONUS[np.minimum(size, len(GROUP_BONUS)-1)], 0).sum(axis=(1, 2))
+        groups = roots.sum(axis=(1, 2))
+        cells[popping] = 0
+        self.cells[boards, :top] = cells
+        return popping.sum(axis=(1, 2)), group_bonus, groups
+
+    def resolve(self, boards=None):
+        # Popping and gravity until nothing pops, then scores each board's chain like Grid.update_verify
+        # Only boards that popped something are looked at again, so one long chain doesn't slow every other board down
+        # boards is an index array of the boards that have changed, every board that's alive if None
+        # Returns the score each board got
+        active = np.flatnonzero(~self.dead) if boards is None else boards
+        chain_power = np.zeros(len(self), dtype=np.int64)
+        beans_popped = np.zeros(len(self), dtype=np.int64)
+        bonus = np.zeros(len(self), dtype=np.int64) # Group bonus plus colour bonus
+        while len(active):
+            popped, group_bonus, groups = self.pop(active)
+            popping = popped > 0
+            active = active[popping]
+            chain_power[active] += 1
+            beans_popped[active] = np.maximum(beans_popped[active], popped[popping])
+            bonus[active] += group_bonus[popping]+COLOUR_BONUS[np.minimum(groups[popping], len(COLOUR_BONUS)-1)]
+            self.gravity(active)
+        multiplier = CHAIN_POWER[np.minimum(chain_power, len(CHAIN_POWER)-1)]+bonus
+        gained = 10*beans_popped*np.where(multiplier > 0, multiplier, 1)
+        self.score += gained
+        self.chains = chain_power
+        # The same death check as Grid, a bean in the third column of the top row
+        self.dead |= self.cells[:, self.rows-1, 2] > 0
+        return gained
+
+    def place(self, primary, secondary, column, rotation):
+        # Drops a pair of beans on every board and resolves the chain it sets off
+        # Each argument can be one number for every board or an array with one for each board, primary, secondary and rotation are the same as FallingBean
+        # Dead boards are left alone, and a pair that would go over the top of the grid kills the board
+        # Returns the score each board got
+        n = len(self)
+        primary, secondary = np.broadcast_to(primary, n), np.broadcast_to(secondary, n)
+        column, rotation = np.broadcast_to(column, n), np.broadcast_to(rotation, n)
+        if (rotation < 0).any() or (rotation > 3).any():
+            raise ValueError("Invalid rotation state")
+        other = column+np.choose(rotation, (0, 1, 0, -1)) # The secondary bean's column
+        if (column < 0).any() or (column >= self.columns).any() or (other < 0).any() or (other >= self.columns).any():
+            raise ValueError("Pair placed outside the grid")
+        heights = (self.cells > 0).sum(axis=1)
+        boards = np.arange(n)
+        # Rotation 2 puts the secondary bean below, otherwise the primary bean lands first
+        first_colour = np.where(rotation == 2, secondary, primary)
+        second_colour = np.where(rotation == 2, primary, secondary)
+        first_row = heights[boards, column]
+        second_row = np.where(other == column, first_row+1, heights[boards, other])
+        alive = ~self.dead & (first_row < self.height) & (second_row < self.height)
+        self.dead |= ~alive
+        boards = boards[alive]
+        self.cells[boards, first_row[alive], column[alive]] = first_colour[alive]
+        self.cells[boards, second_row[alive], other[alive]] = second_colour[alive]
+        return self.resolve(boards)
@@ -0,0 +1,126 @@
+import time
+# Searching stops when the time budget runs out
+from board import placements
+
+class Solver:
+# Finds where to put the falling pair of beans, using the same rules as Grid on BitBoards
+# Every placement of the current pair is tried, then every placement of the next pair on each of the boards that makes, and a placement is worth the best total score after both
+# Results are kept in a transposition cache keyed on the board, so boards that can be reached in more than one way, or that are searched again next frame, are only worked out once
+# The time budget is checked before every drop, so a search goes over it by at most one drop (one placement and the chain it sets off) plus scoring what it has
+# If it runs out while placing the first pair, the best of the placements tried so far is returned, and at least one is always tried
+# If it runs out during the second pair, the placements that didn't get their second pair fully tried are judged on the first pair alone, best first pair placements are tried first so they're the ones that get searched
+# Calling again with the same board carries on where the last call stopped, as every drop is cached, so a hint can be worked out over a few frames
+
+    # Worth of losing, so any placement that doesn't lose is better
+    death = -1_000_000
+
+    def __init__(self, rows=12, columns=6, budget=0.002, cache_size=100_000):
+        self.rows, self.columns = rows, columns
+        self.budget = budget # Seconds each search can take
+        self.cache_size = cache_size # The cache is emptied when it has more entries than this
+        self.placements = placements(columns)
+        self.drops = {} # (board, primary, secondary, column, rotation): (board after the chain, score, dead)
+        self.values = {} # (board, primary, secondary): worth of the best placement of that pair on that board
+        self.death_bit = 1 << ((rows-1)*columns+2) # The same death cell as Grid
+        # Every cell in each column, up to twice the height of the grid
+        self.column_masks = [sum(1 << (n*columns+c) for n in range(rows*2)) for c in range(columns)]
+
+    def heights(self, board):
+        # The number of beans in each column, which is how high they go as the board has had gravity applied
+        occupied = board.occupied
+        return [(occupied & x).bit_count() for x in self.column_masks]
+
+    def reachable(self, heights, column, other):
+        # A falling pair starts in the third column above the top row and is moved sideways, so it can't get past a column that's taller than the grid
+        low, high = min(2, column, other), max(2, column, other)
+        return all(heights[x] <= self.rows for x in range(low, high+1))
+
+    def drop(self, board, primary, secondary, column, rotation):
+        # Places a pair like FallingBean.place_beans and resolves the chain it sets off
+        # Returns (the board after, the score for the chain, whether the grid died), or None if the pair can't get there
+        key = (board, primary, secondary, column, rotation)
+        if key in self.drops:
+            return self.drops[key]
+        c = self.columns
+        other = column+(0, 1, 0, -1)[rotation]
+        heights = self.heights(board)
+        if not self.reachable(heights, column, other):
+            out = None
+        else:
+            board = board.copy()
+            if other == column:
+                # Rotation 2 puts the secondary bean underneath
+                first, second = (secondary, primary) if rotation == 2 else (primary, secondary)
+                a, b = heights[column]*c+column, (heights[column]+1)*c+column
+            else:
+                first, second = primary, secondary
+                a, b = heights[column]*c+column, heights[other]*c+other
+            board.set(a, first)
+            board.set(b, second)
+            score = board.resolve(1 << a | 1 << b)
+            out = (board, score, bool(board.occupied & self.death_bit))
+        self.drops[key] = out
+        return out
+
+    def shape(self, board):
+        # A small bonus for boards that are likely to score later, so the solver doesn't just put beans anywhere when nothing can pop yet
+        # One point for every pair of touching beans of the same colour, minus the height of the column with the death cell in it
+        c = self.columns
+        height, not_first, not_last = board.edges(board.occupied.bit_length()//c+2)
+        out = 0
+        for x in board.masks[1:]:
+            out += (x & (x >> c)).bit_count()+(x & not_last & (x >> 1)).bit_count()
+        return out-self.heights(board)[2]
+
+    def value(self, board, pair, deadline=None):
+        # The worth of the best placement of one pair on a board
+        # Returns None if the deadline passes before every placement is tried, which isn't cached as the drops that were done are
+        key = (board, *pair)
+        if key not in self.values:
+            best = self.death
+            for column, rotation in self.placements:
+                if deadline is not None and time.perf_counter() > deadline:
+                    return None
+                x = self.drop(board, *pair, column, rotation)
+                if x is not None:
+                    best = max(best, self.death if x[2] else x[1]+self.shape(x[0]))
+            self.values[key] = best
+        return self.values[key]
+
+    def search(self, board, pair, next_pair=None):
+        # Returns (column, rotation, score) of the best placement of pair, score being how much it's worth
+        # pair and next_pair are (primary colour, secondary colour)
+        deadline = time.perf_counter()+self.budget
+        board = board.copy() # Boards are cache keys, so the one being searched can't be one that's going to change
+        if len(self.drops) > self.cache_size or len(self.values) > self.cache_size:
+            self.drops.clear()
+            self.values.clear()
+        # At least one placement of the first pair is always tried, as a hint has to be given even if it takes longer than the budget
+        first = {}
+        for column, rotation in self.placements:
+            if first and time.perf_counter() > deadline:
+                break
+            x = self.drop(board, *pair, column, rotation)
+            if x is not None:
+                first[(column, rotation)] = x
+        if not first:
+            return None # Nowhere the pair can go
+        worth = {k: self.death if dead else score+self.shape(after) for k, (after, score, dead) in first.items()}
+        if next_pair is not None:
+            for k in sorted(worth, key=worth.get, reverse=True):
+                if time.perf_counter() > deadline:
+                    break
+                after, score, dead = first[k]
+                if not dead:
+                    x = self.value(after, next_pair, deadline)
+                    if x is None:
+                        break
+                    worth[k] = score+x
+        best = max(worth, key=worth.get)
+        return (*best, worth[best])
+
+    def hint(self, grid):
+        # The best placement of a Grid's falling pair, also knowing what the next pair in its queue is
+        # The queue's pair is (top, bottom) like FallingBean takes it, and the bottom bean is the primary
+        falling, queue = grid.falling, grid.queue.next
+        return self.search(grid.board, (falling.primary.colour, falling.secondary.colour), (queue[1].colour, queue[0].colour))
@@ -0,0 +1,117 @@
+import sys
+import os
+GAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(GAME)
+# So the game and kris_engine can be imported when pytest is run from anywhere
+import pytest
+from random import Random
+from board import BitBoard
+
+# Checks the bitwise group finding and gravity against doing it one cell at a time on a list of colours like Grid.values
+
+def random_values(random, rows, columns, empty):
+    # Every cell is empty with a chance of empty, otherwise a random colour
+    return [0 if random.random() < empty else random.randint(1, 5) for x in range(rows*columns)]
+
+def board_from(values, columns):
+    board = BitBoard(columns)
+    for position, colour in enumerate(values):
+        if colour:
+            board.set(position, colour)
+    return board
+
+def flood_groups(values, columns):
+    # Every group of the same colour as a set of positions, found by flood filling from every cell that isn't in a group yet
+    seen, groups = set(), []
+    for start, colour in enumerate(values):
+        if not colour or start in seen:
+            continue
+        group, stack = {start}, [start]
+        while stack:
+            x = stack.pop()
+            for y in (x+columns, x-columns, x-1 if x % columns else -1, x+1 if (x+1) % columns else -1):
+                if 0 <= y < len(values) and y not in group and values[y] == colour:
+                    group.add(y)
+                    stack.append(y)
+        seen |= group
+        groups.append((colour, group))
+    return groups
+
+def compact(values, columns):
+    # Moves every bean to the bottom of its column, keeping them in the same order
+    out = [0]*len(values)
+    for column in range(columns):
+        beans = [x for x in values[column::columns] if x]
+        for row, colour in enumerate(beans):
+            out[row*columns+column] = colour
+    return out
+
+def as_sets(groups):
+    return sorted((colour, sorted(BitBoard.positions(mask))) for colour, mask in groups)
+
+SHAPES = [(12, 6), (24, 6), (5, 3), (8, 1), (4, 9)]
+
+@pytest.mark.parametrize("rows, columns", SHAPES)
+@pytest.mark.parametrize("empty", [0, 0.3, 0.7])
+def test_groups(rows, columns, empty):
+    random = Random(rows*100+columns)
+    for n in range(50):
+        values = random_values(random, rows, columns, empty)
+        board = board_from(values, columns)
+        groups = flood_groups(values, columns)
+        for size in (1, 4):
+            assert as_sets(board.groups(size)) == sorted((colour, sorted(group)) for colour, group in groups if len(group) >= size)
+        for position in range(len(values)):
+            group = next((group for colour, group in groups if position in group), set())
+            assert sorted(board.positions(board.group(position))) == sorted(group)
+
+@pytest.mark.parametrize("rows, columns", SHAPES)
+def test_remove_and_gravity(rows, columns):
+    random = Random(rows*100+columns)
+    for n in range(50):
+        values = random_values(random, rows, columns, 0.3)
+        board = board_from(values, columns)
+        # Pop every group of 4 or more, like a link of a chain
+        popped = set()
+        for colour, group in flood_groups(values, columns):
+            if len(group) >= 4:
+                popped |= group
+        for colour, mask in board.groups():
+            board.remove(mask)
+        values = [0 if x in popped else colour for x, colour in enumerate(values)]
+        assert [board.colour(x) for x in range(len(values))] == values
+        expected = compact(values, columns)
+        assert board.gravity() == (expected != values)
+        assert [board.colour(x) for x in range(len(values))] == expected
+        assert board.occupied >> len(values) == 0
+        assert not board.gravity()
+
+def test_disjoint_set_follows_set_value(tmp_path, monkeypatch):
+    # Puts random beans in and takes them out of a real Grid, and checks its DisjointSet has the same groups as its BitBoard after every change
+    # connected is looked at after every change, so beans put in are added to the DisjointSet one at a time as they would be in a game
+    from kris_engine import Engine
+    from kris_engine.log import WARNING
+    from exercise import ExerciseClassic
+    from gameplay import Grid, Bean, InputHandler
+    monkeypatch.chdir(tmp_path)
+    class Empty(ExerciseClassic):
+        kap = ()
+        def __init__(self, engine):
+            self.engine = engine
+            input_handler = self.engine.load_entity(InputHandler, self)
+            self.grid = self.engine.load_entity(Grid, self, input_handler, values=[None]*72, seed=0)
+    engine = Engine(scene=Empty, headless=True, engine_path=os.path.join(GAME, "kris_engine"), log_path=str(tmp_path / "log.txt"), log_level=WARNING)
+    grid = engine.scene.grid
+    random = Random(20)
+    for n in range(2000):
+        position = random.randrange(72)
+        grid.set_value(position, None if random.random() < 0.2 else Bean(random.randint(1, 4)))
+        values = [x.colour if x else 0 for x in grid.values]
+        expected = as_sets(grid.board.groups(1))
+        assert sorted((values[group[0]], sorted(group)) for group in grid.connected.groups()) == expected
+        assert expected == sorted((colour, sorted(group)) for colour, group in flood_groups(values, 6))
+        if values[position]:
+            assert grid.connected.size(position) == grid.board.group(position).bit_count()
+        else:
+            assert position not in grid.connected
+    engine.quit()
@@ -0,0 +1,63 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+# So kris_engine can be imported when pytest is run from anywhere
+from kris_engine.cache import AssetCache
+from kris_engine.log import WARNING
+
+# Checks which assets the cache throws away, with sizes given so no real surfaces are needed
+
+class Log:
+    # Stands in for the engine, keeping what the cache logs
+    def __init__(self):
+        self.messages = []
+
+    def append_log(self, message, *args, level=None):
+        self.messages.append((level, message % args))
+
+def test_least_recently_used_goes_first():
+    cache = AssetCache(300)
+    for x in "abc":
+        cache.put(("image", x, "raw"), x, size=100)
+    cache.get(("image", "a", "raw"))
+    cache.put(("image", "d", "raw"), "d", size=100)
+    assert list(cache.entries) == [("image", "c", "raw"), ("image", "a", "raw"), ("image", "d", "raw")]
+    assert cache.size == 300 and cache.evictions == 1
+
+def test_pinned_over_budget():
+    # Pinned assets are kept even when they're over budget, everything else is thrown away, and a warning is logged once
+    log = Log()
+    cache = AssetCache(250, engine=log)
+    cache.pinned = {"a", "b", "c"}
+    cache.put(("audio", "x"), "x", size=50)
+    for x in "abc":
+        cache.put(("image", x, "raw"), x, size=100)
+    assert list(cache.entries) == [("image", x, "raw") for x in "abc"]
+    assert cache.stats()["pinned"] == 300 and cache.unpinned == 0
+    # A new asset that isn't pinned is kept, as it's about to be used, but there's nothing else to throw away
+    cache.put(("audio", "y"), "y", size=50)
+    assert ("audio", "y") in cache and cache.size == 350 and cache.unpinned == 50
+    assert log.messages == [(WARNING, "Pinned assets take up 300 bytes, which is more than the cache budget of 250 bytes, raise cache_budget")]
+    # Then it's the one that goes next time
+    cache.put(("audio", "z"), "z", size=50)
+    assert ("audio", "y") not in cache and ("audio", "z") in cache
+    assert len(log.messages) == 1
+    # A new scene's pins can warn again
+    cache.pinned = {"a", "b", "c", "z"}
+    cache.put(("image", "d", "raw"), "d", size=10)
+    assert len(log.messages) == 2
+    assert cache.unpinned == 10 and ("audio", "z") in cache
+
+def test_sizes_follow_pins_and_clear():
+    cache = AssetCache()
+    cache.put(("image", "a", "raw"), "a", size=100)
+    cache.put(("audio", "b"), "b", size=10)
+    cache.pinned = {"a"}
+    assert cache.unpinned == 10
+    cache.put(("image", "a", "raw"), "a", size=70) # Replacing an asset doesn't count it twice
+    assert cache.size == 80 and cache.unpinned == 10
+    cache.clear("image")
+    assert cache.size == 10 and cache.unpinned == 10
+    cache.pinned = set()
+    cache.clear()
+    assert cache.size == 0 and cache.unpinned == 0
@@ -0,0 +1,38 @@
+import sys
+import os
+GAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(GAME)
+# So kris_engine can be imported when pytest is run from anywhere
+import pytest
+from kris_engine import Engine, Scene
+from kris_engine.log import WARNING
+from kris_engine.pbar import ProgressBar
+
+# Checks that an asset that can't be loaded is counted by the progress bar, while getting it normally still gives the replacement
+
+class Empty(Scene):
+    kap = ()
+    def __init__(self, engine):
+        self.engine = engine
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = Engine(scene=Empty, headless=True, engine_path=os.path.join(GAME, "kris_engine"), log_path=str(tmp_path / "log.txt"), log_level=WARNING)
+    yield engine
+    engine.quit()
+
+def test_strict_raises(engine):
+    with pytest.raises(KeyError):
+        engine.get_asset("broken.png", strict=True)
+    with pytest.raises(KeyError):
+        engine.preload("broken.ogg")
+    # Nothing is cached for it, so getting it normally still gives missing.png
+    assert engine.get_asset("broken.png").get_size() == engine.get_asset("missing.png").get_size()
+    assert engine.preload("missing.png") is engine.get_asset("missing.png")
+
+def test_pbar_counts_failures(engine):
+    bar = engine.load_entity(ProgressBar, engine.scene, engine.preload, ["missing.png", "broken.png", "broken.ogg"], 3, lambda x: 1, Empty)
+    bar.thread.join()
+    assert [x for x, e in bar.failed] == ["broken.png", "broken.ogg"]
+    assert engine.pbar_out[0] is engine.get_asset("missing.png") and engine.pbar_out[1:] == [None, None]
+    assert bar.progress == 3
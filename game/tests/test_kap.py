@@ -0,0 +1,122 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+# So kris_engine can be imported when pytest is run from anywhere
+import pytest
+from random import Random
+from PIL import Image
+import kris_engine.files as files
+
+# Builds small KAP files from a folder of made up assets and checks what comes out of them
+
+QUALITIES = {"high": 1, "low": 0.5}
+IMAGES = ["solid.png", "noise.png", "stripes.png"]
+OTHERS = ["noise.ogg", "zeros.ogg", "text.txt", "one.bin"]
+ENGINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kris_engine")
+
+@pytest.fixture(scope="module")
+def assets(tmp_path_factory):
+    # A folder with a few images and files that compress well, badly and not at all
+    folder = tmp_path_factory.mktemp("assets")
+    random = Random(1993)
+    Image.new("RGBA", (40, 30), (200, 10, 10, 255)).save(folder / "solid.png")
+    Image.frombytes("RGB", (32, 32), random.randbytes(32*32*3)).save(folder / "noise.png")
+    Image.frombytes("L", (64, 16), bytes(x//8 % 2*255 for x in range(64*16))).save(folder / "stripes.png")
+    (folder / "noise.ogg").write_bytes(random.randbytes(5000))
+    (folder / "zeros.ogg").write_bytes(bytes(70000))
+    (folder / "text.txt").write_bytes(b"Kris's Asset Package\n"*50)
+    (folder / "one.bin").write_bytes(b"\x07")
+    return folder
+
+def build(folder, out, **kwargs):
+    # build names files by the paths it's given, so it's run from inside the folder
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        files.build(QUALITIES, IMAGES, OTHERS, str(out), **kwargs)
+    finally:
+        os.chdir(cwd)
+    return out.read_bytes()
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_parallel_build_matches(assets, tmp_path, version):
+    # Worker processes have to give exactly the same file as building everything in this process
+    serial = build(assets, tmp_path / "serial.kap", version=version, workers=1)
+    parallel = build(assets, tmp_path / "parallel.kap", version=version, workers=2)
+    assert serial == parallel
+
+def contents(kap):
+    # Every file in a KAP file, and every quality of the ones that have them, as bytes
+    out = {}
+    for name, pointer in kap.assets.items():
+        for quality in pointer if isinstance(pointer, dict) else [None]:
+            out[(name, quality)] = kap.load(name, quality).read()
+    return out
+
+@pytest.fixture(scope="module")
+def packs(assets, tmp_path_factory):
+    # The assets built as version 1 and version 2
+    folder = tmp_path_factory.mktemp("packs")
+    out = {}
+    for version in (1, 2):
+        out[version] = folder / f"v{version}.kap"
+        build(assets, out[version], version=version)
+    return out
+
+def test_default_kap_is_still_read():
+    # default.kap was built before version 2 existed, every file in it should come out the same as the file it was made from
+    kap = files.KAP(os.path.join(ENGINE, "default.kap"))
+    assert kap.open == ["default.kap"]
+    for name in kap.assets:
+        with open(os.path.join(ENGINE, "resources", name), "rb") as f:
+            assert kap.load(name).read() == f.read()
+
+def test_versions_match(assets, packs):
+    # Both versions have the same files with the same contents, and files without qualities are stored exactly as they were
+    v1, v2 = files.KAP(str(packs[1])), files.KAP(str(packs[2]))
+    assert v1.assets.keys() == v2.assets.keys() == set(IMAGES+OTHERS)
+    v1, v2 = contents(v1), contents(v2)
+    assert v1 == v2
+    assert set(v2) == {(x, None) for x in OTHERS} | {(x, y) for x in IMAGES for y in QUALITIES}
+    for name in OTHERS:
+        assert v2[(name, None)] == (assets / name).read_bytes()
+    for name in IMAGES:
+        assert Image.open(files.BytesIO(v2[(name, "low")])).width == round(Image.open(assets / name).width*QUALITIES["low"])
+
+def test_find_v2(packs):
+    # Looking a file up through the hash table gives the same as reading the whole directory
+    kap = files.KAP(str(packs[2]))
+    m = kap.file_map[IMAGES[0]]
+    for name, pointer in kap.assets.items():
+        assert kap.find_v2(m, name) == pointer
+    assert kap.find_v2(m, "missing.png") is None
+    assert kap.find_v2(m, "") is None
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_lazy_matches(packs, version):
+    # Opening lazily finds nothing up front, then gives the same files as opening normally
+    eager, lazy = files.KAP(str(packs[version])), files.KAP(str(packs[version]), lazy=True)
+    assert lazy.assets == {}
+    for name in eager.assets:
+        assert lazy.entry(name) == eager.assets[name]
+    assert contents(lazy) == contents(eager)
+
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("version", [1, 2])
+def test_missing_file(packs, version, lazy):
+    kap = files.KAP(str(packs[version]), lazy=lazy)
+    with pytest.raises(KeyError):
+        kap.entry("missing.png")
+    with pytest.raises(KeyError):
+        kap.load("missing.png")
+    # A failed lookup doesn't stop later ones working
+    assert kap.load(OTHERS[0]).read() == files.KAP(str(packs[version])).load(OTHERS[0]).read()
+
+def test_lazy_order(packs):
+    # With more than one KAP file open lazily, a file comes from the newest one that has it, the same as opening them normally
+    # Both packs have the same names, so the one each file comes from is told apart by its memory map
+    for lazy in (False, True):
+        kap = files.KAP(str(packs[1]), lazy=lazy)
+        kap.load_kap(str(packs[2]), lazy=lazy)
+        kap.load(OTHERS[0])
+        assert kap.file_map[OTHERS[0]][2] == 255 # Version 2 was opened last
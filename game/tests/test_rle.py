@@ -0,0 +1,92 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+# So kris_engine can be imported when pytest is run from anywhere
+import pytest
+from random import Random
+from math import log2
+import kris_engine.files as files
+
+# Checks that the numpy RLE functions give exactly the same bytes as the pure python ones, and that both decode back to the input
+# Empty input isn't tested, as rle_encode_python can't encode it (it's never given empty files)
+pytestmark = pytest.mark.skipif(files.np is None, reason="numpy isn't installed, so there's nothing to compare against")
+
+SETTINGS = [(1, 1), (2, 1), (1, 3), (3, 4), (2, 15), (9, 2)]
+LENGTHS = [1, 2, 3, 4, 5, 15, 16, 17, 1000, 4099]
+# Runs that are exactly as long as a counter can hold, or one either side, so they have to be split or only just don't
+RUNS = [254, 255, 256, 509, 510, 511, 65534, 65535, 65536]
+
+def random_data(length):
+    return Random(length).randbytes(length)
+
+def equal_data(length):
+    return b'\xab'*length
+
+def alternating_data(length):
+    return (b'\x00\xff'*length)[:length]
+
+def joined(out):
+    # The encoders give a list of bytes to be joined, apart from when there's no compression
+    return out if type(out) == bytes else b''.join(out)
+
+def round_trip(data, counter_length, pattern_length):
+    slow = joined(files.rle_encode_python(data, counter_length, pattern_length))
+    fast = joined(files.rle_encode_numpy(data, counter_length, pattern_length))
+    assert slow == fast
+    assert files.rle_decode_python(fast) == data
+    assert files.rle_decode_numpy(fast) == data
+
+@pytest.mark.parametrize("counter_length, pattern_length", SETTINGS)
+@pytest.mark.parametrize("make", [random_data, equal_data, alternating_data])
+@pytest.mark.parametrize("length", LENGTHS)
+def test_round_trip(make, length, counter_length, pattern_length):
+    round_trip(make(length), counter_length, pattern_length)
+
+@pytest.mark.parametrize("counter_length, pattern_length", SETTINGS)
+@pytest.mark.parametrize("length", RUNS)
+def test_counter_boundaries(length, counter_length, pattern_length):
+    round_trip(equal_data(length*pattern_length), counter_length, pattern_length)
+    round_trip(b'\x01' + equal_data(length*pattern_length) + b'\x02', counter_length, pattern_length)
+
+def test_no_compression():
+    # A counter or pattern length of 0 stores the data as it is
+    data = random_data(100)
+    for counter_length, pattern_length in ((0, 1), (1, 0), (0, 0)):
+        round_trip(data, counter_length, pattern_length)
+
+# rle_sizes has to give exactly how long rle_encode's output would be, as rle_brute only encodes the setting it says is smallest
+# It's checked with and without numpy, as they count runs differently
+
+@pytest.fixture(params=[True, False], ids=["numpy", "python"])
+def numpy(request, monkeypatch):
+    if not request.param:
+        monkeypatch.setattr(files, "np", None)
+    return request.param
+
+def check_sizes(data, counter_lengths=sorted({x for x, y in SETTINGS}), pattern_lengths=sorted({y for x, y in SETTINGS})):
+    sizes = files.rle_sizes(data, counter_lengths, pattern_lengths)
+    assert set(sizes) == {(x, y) for x in counter_lengths for y in pattern_lengths}
+    for (counter_length, pattern_length), size in sizes.items():
+        assert size == len(joined(files.rle_encode_python(data, counter_length, pattern_length)))
+
+@pytest.mark.parametrize("make", [random_data, equal_data, alternating_data])
+@pytest.mark.parametrize("length", LENGTHS)
+def test_sizes(numpy, make, length):
+    check_sizes(make(length))
+
+@pytest.mark.parametrize("counter_length, pattern_length", SETTINGS)
+@pytest.mark.parametrize("length", RUNS)
+def test_sizes_counter_boundaries(numpy, length, counter_length, pattern_length):
+    check_sizes(equal_data(length*pattern_length), [counter_length], [pattern_length])
+    check_sizes(b'\x01' + equal_data(length*pattern_length) + b'\x02', [counter_length], [pattern_length])
+
+@pytest.mark.parametrize("make", [random_data, equal_data, alternating_data])
+@pytest.mark.parametrize("length", [1, 17, 4099, 70000])
+def test_brute_picks_smallest(numpy, make, length):
+    # rle_brute's output is the smallest of every setting it tries, or the data as it is if that's smaller
+    data = make(length)
+    counter_lengths = range(1, max(int(log2(length)/8), 1)+1)
+    smallest = min(len(data)+1, *files.rle_sizes(data, counter_lengths, range(1, 16)).values())
+    out = files.rle_brute(data)
+    assert len(out) == smallest
+    assert files.rle_decode(out) == data